@@ -6,6 +6,21 @@ CREATE TABLE IF NOT EXISTS conversations (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- Keyset pagination for the conversation list (newest first)
+CREATE INDEX IF NOT EXISTS conversations_created_at_id_idx ON conversations (created_at DESC, id DESC);
+
+-- Append-only message store: one row per chat turn. Conversations saved this
+-- way leave conversations.conversation NULL; older rows are copied over by
+-- `python docs/message_store.py <dsn>`.
+CREATE TABLE IF NOT EXISTS conversation_messages (
+    conversation_id BIGINT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL, -- 0-based position of the message in the transcript
+    role TEXT,
+    message TEXT NOT NULL, -- JSON of the message object
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (conversation_id, seq)
+);
+
 -- Create chat_call_info table
 CREATE TABLE IF NOT EXISTS chat_call_info (
     id BIGSERIAL PRIMARY KEY,
@@ -18,9 +33,20 @@ CREATE TABLE IF NOT EXISTS chat_call_info (
     execution_time REAL, -- in milliseconds
     status TEXT, -- 'success', 'error', etc.
     error_message TEXT,
+    stage TEXT, -- pipeline stage, e.g. 'convert_to_sql', 'run_sql_query'
+    rows_returned INTEGER,
+    bytes_returned BIGINT,
+    cache_hit BOOLEAN,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- Columns added for pipeline instrumentation (docs/instrumentation.py)
+ALTER TABLE chat_call_info ADD COLUMN IF NOT EXISTS stage TEXT;
+ALTER TABLE chat_call_info ADD COLUMN IF NOT EXISTS rows_returned INTEGER;
+ALTER TABLE chat_call_info ADD COLUMN IF NOT EXISTS bytes_returned BIGINT;
+ALTER TABLE chat_call_info ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN;
+CREATE INDEX IF NOT EXISTS chat_call_info_stage_created_at_idx ON chat_call_info (stage, created_at);
+
 -- Create a function to execute read-only queries
 CREATE OR REPLACE FUNCTION execute_read_query(query_text TEXT, query_params JSONB DEFAULT '[]'::JSONB)
 RETURNS JSONB
@@ -221,6 +247,15 @@ CREATE TABLE IF NOT EXISTS page_entity_crosswalk (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- Indexes for the EAV pivots generated SQL relies on (see docs/pivot_views.py)
+CREATE INDEX IF NOT EXISTS extracted2_filename_key_idx ON extracted2 (filename, key);
+CREATE INDEX IF NOT EXISTS extracted2_page_label_id_idx ON extracted2 (page_label, id);
+CREATE INDEX IF NOT EXISTS pages_preprocessed_idx ON pages (preprocessed);
+CREATE INDEX IF NOT EXISTS entities_entity_name_idx ON entities (entity_name);
+
+-- Incremental refresh of the entity name index (see docs/entity_resolver.py)
+CREATE INDEX IF NOT EXISTS entities_created_at_id_idx ON entities (created_at, entity_id);
+
 -- Insert sample data for testing
 
 -- Insert sample entities
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import asyncpg
+import pandas as pd
+from openai import AsyncOpenAI
+
+from batch_questions import BatchAnswer, result_error
+from nl_sql_cache import normalize_question
+from result_cache import is_cacheable, is_write
+from sql_guard import analyze, check_cost, explain_async, set_statement_timeout_async
+from sql_prompt import PromptBuilder, extract_sql
+
+
+def supabase_connect_kwargs() -> dict:
+    """asyncpg connection settings from the same SUPABASE_* variables chat_ui uses."""
+    return {
+        "user": os.environ.get("SUPABASE_USER"),
+        "password": os.environ.get("SUPABASE_PASSWORD"),
+        "host": os.environ.get("SUPABASE_HOST"),
+        "port": int(os.environ.get("SUPABASE_PORT", 5432)),
+        "database": os.environ.get("SUPABASE_DBNAME"),
+    }
+
+
+class AsyncPipeline:
+    """asyncio version of the NL->SQL->result flow in chat_ui.
+
+    One instance serves many concurrent chat sessions: the OpenAI and Postgres
+    calls are awaited instead of blocking, ``max_concurrency`` bounds how many
+    requests are in flight at once, and every stage runs under its own timeout.
+    Queries get the same checks as chat_ui: ``query_timeout`` is also set as the
+    server-side statement_timeout, and statements whose planner cost exceeds
+    ``max_cost`` are rejected before they run.
+    The NL->SQL and result caches from chat_ui can be shared by passing them in.
+
+    ``examples`` is a list of ``{"question", "sql"}`` pairs as in prompt_resources.
+    Use as ``async with AsyncPipeline(schema, examples) as pipeline: ...``.
+    """
+
+    def __init__(
+        self,
+        schema: str,
+        examples: list,
+        model: str = "gpt-4o",
+        openai_client: AsyncOpenAI = None,
+        connect_kwargs: dict = None,
+        pool_min: int = 1,
+        pool_max: int = 10,
+        max_concurrency: int = 32,
+        token_budget: int = None,
+        llm_timeout: float = 60.0,
+        query_timeout: float = 30.0,
+        save_timeout: float = 10.0,
+        auto_limit: int = 1000,
+        max_cost: float = None,
+        sql_cache=None,
+        result_cache=None,
+    ):
+        self.model = model
+        self.prompt_builder = PromptBuilder(schema, examples, model=model, token_budget=token_budget)
+        self.client = openai_client or AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.connect_kwargs = connect_kwargs if connect_kwargs is not None else supabase_connect_kwargs()
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.llm_timeout = llm_timeout
+        self.query_timeout = query_timeout
+        self.save_timeout = save_timeout
+        self.auto_limit = auto_limit
+        self.max_cost = max_cost
+        self.sql_cache = sql_cache
+        self.result_cache = result_cache
+        self._limiter = asyncio.Semaphore(max_concurrency)
+        self._pool = None
+
+    async def start(self):
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(
+                min_size=self.pool_min, max_size=self.pool_max, **self.connect_kwargs
+            )
+        return self
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # --- Stages ---
+    async def convert_to_sql(self, nl_query: str) -> str:
+        cache_context = self.prompt_builder.fingerprint
+        if self.sql_cache is not None:
+            cached_sql = self.sql_cache.get(nl_query, cache_context)
+            if cached_sql is not None:
+                return cached_sql
+        prompt = self.prompt_builder.build(nl_query)
+        async with self._limiter:
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    messages=prompt.messages,
+                    model=self.model,
+                    temperature=0,
+                ),
+                timeout=self.llm_timeout,
+            )
+        sql_query = extract_sql(response.choices[0].message.content)
+        analyze(sql_query)
+        if self.sql_cache is not None:
+            self.sql_cache.put(nl_query, cache_context, sql_query)
+        return sql_query
+
+    async def run_sql_query(self, query: str) -> pd.DataFrame:
+        """Same contract as chat_ui.run_sql_query: errors come back as an ``error`` frame."""
+        cacheable = self.result_cache is not None and is_cacheable(query)
+        if cacheable:
+            snapshot = self.result_cache.snapshot(query)
+            cached = self.result_cache.get(query)
+            if cached is not None:
+                return cached
+        try:
+            analysis = analyze(query, auto_limit=self.auto_limit)
+            async with self._limiter:
+                async with self._pool.acquire() as conn, conn.transaction():
+                    await set_statement_timeout_async(conn, self.query_timeout * 1000)
+                    if self.max_cost is not None:
+                        await explain_async(conn, analysis, timeout=self.query_timeout)
+                        check_cost(analysis, self.max_cost)
+                    if analysis.is_read:
+                        records = await conn.fetch(analysis.sql, timeout=self.query_timeout)
+                        columns = list(records[0].keys()) if records else []
+                        df = pd.DataFrame.from_records([tuple(r) for r in records], columns=columns)
+                    else:
+                        status = await conn.execute(analysis.sql, timeout=self.query_timeout)
+                        count = status.rsplit(" ", 1)[-1]  # command tag, e.g. "UPDATE 42"
+                        df = pd.DataFrame({
+                            "statement_type": [analysis.statement_type],
+                            "rows_affected": [int(count) if count.isdigit() else None],
+                        })
+        except asyncio.TimeoutError:
+            return pd.DataFrame({"error": [f"Query timed out after {self.query_timeout}s"]})
+        except Exception as e:
+            return pd.DataFrame({"error": [str(e)]})
+        if cacheable:
+            self.result_cache.put(query, df, snapshot)
+        elif self.result_cache is not None and is_write(query):
+            self.result_cache.invalidate_for_write(query)
+        return df
+
+    async def save_conversation(self, conversation, title="Conversation", conversation_id=None):
+        """Append the conversation's unsaved turns (see message_store) and return its id."""
+        if title == "Conversation":
+            title = f"Conversation on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                if conversation_id is None:
+                    conversation_id = await conn.fetchval(
+                        "INSERT INTO conversations (title) VALUES ($1) RETURNING id",
+                        title,
+                        timeout=self.save_timeout,
+                    )
+                start = await conn.fetchval(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM conversation_messages WHERE conversation_id = $1",
+                    conversation_id,
+                    timeout=self.save_timeout,
+                )
+                rows = [
+                    (conversation_id, start + offset, message.get("role"), json.dumps(message))
+                    for offset, message in enumerate(conversation[start:])
+                ]
+                if rows:
+                    await conn.executemany(
+                        "INSERT INTO conversation_messages (conversation_id, seq, role, message) "
+                        "VALUES ($1, $2, $3, $4) ON CONFLICT (conversation_id, seq) DO NOTHING",
+                        rows,
+                        timeout=self.save_timeout,
+                    )
+        return conversation_id
+
+    async def answer(self, nl_query: str):
+        """Generate SQL and, for reads, run it. Writes are returned unexecuted for confirmation."""
+        sql_query = await self.convert_to_sql(nl_query)
+        if not analyze(sql_query).is_read:  # also catches WITH ... (DELETE ... RETURNING) SELECT
+            return sql_query, None
+        return sql_query, await self.run_sql_query(sql_query)
+
+    async def answer_many(self, questions) -> list:
+        """``answer`` for several questions at once, deduplicated; one BatchAnswer per question, in order."""
+        questions = list(questions)
+        keys = [normalize_question(question) for question in questions]
+        first_question = {}
+        for key, question in zip(keys, questions):
+            first_question.setdefault(key, question)
+        outcomes = dict(zip(
+            first_question,
+            await asyncio.gather(*(self.answer(q) for q in first_question.values()), return_exceptions=True),
+        ))
+        answers = []
+        for question, key in zip(questions, keys):
+            answer = BatchAnswer(question)
+            outcome = outcomes[key]
+            if isinstance(outcome, BaseException):
+                answer.error = f"Error generating SQL query: {outcome}"
+            else:
+                answer.sql, df = outcome
+                if df is None:
+                    answer.error = "This operation modifies the database and was not run; confirm it and run it on its own."
+                elif result_error(df) is not None:
+                    answer.error = result_error(df)
+                else:
+                    answer.result = df
+            answers.append(answer)
+        return answers
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from lazy_imports import lazy_import
+from nl_sql_cache import normalize_question
+from result_cache import normalize_sql
+from sql_guard import Analysis, analyze
+
+pd = lazy_import("pandas")
+
+
+@dataclass
+class BatchAnswer:
+    question: str
+    sql: str = None
+    result: pd.DataFrame = None
+    error: str = None
+
+
+def result_error(df: pd.DataFrame):
+    """run_sql_query reports failures as a one-column ``error`` frame."""
+    if list(df.columns) == ["error"] and len(df):
+        return str(df["error"].iloc[0])
+    return None
+
+
+def answer_batch(questions, convert, run, max_workers: int = 4, run_many=None) -> list:
+    """Answer ``questions`` with ``convert`` (question -> SQL) and ``run`` (SQL -> DataFrame).
+
+    Identical questions (after normalization) are converted once, and
+    identical SQL is run once. SQL generation runs on up to ``max_workers``
+    threads. Read queries then run in parallel on the same number of threads
+    or, when ``run_many`` is given, are handed to it together (list of SQL ->
+    list of DataFrames) so it can run them in one round trip; if that fails
+    they are run one by one. Writes are not run: they come back with their
+    SQL and an error asking for confirmation, as in the chat flow.
+
+    Returns one BatchAnswer per question, in input order.
+    """
+    questions = list(questions)
+    answers = [BatchAnswer(question) for question in questions]
+    keys = [normalize_question(question) for question in questions]
+    unique = list(dict.fromkeys(keys))
+    first_question = {}
+    for key, question in zip(keys, questions):
+        first_question.setdefault(key, question)
+
+    def generate(key):
+        try:
+            return convert(first_question[key]), None
+        except Exception as e:
+            return None, f"Error generating SQL query: {e}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        generated = dict(zip(unique, executor.map(generate, unique)))
+
+        # One execution per distinct read statement
+        reads, rejected = {}, {}
+        for sql, _ in generated.values():
+            if sql is None:
+                continue
+            try:
+                if analyze(sql).is_read:
+                    reads.setdefault(normalize_sql(sql), sql)
+            except ValueError as e:
+                rejected[sql] = str(e)
+        results = {}
+        if run_many is not None and len(reads) > 1:
+            try:
+                results = dict(zip(reads, run_many(list(reads.values()))))
+            except Exception:
+                results = {}
+        pending = [key for key in reads if key not in results]
+        results.update(zip(pending, executor.map(run, [reads[key] for key in pending])))
+
+    for answer, key in zip(answers, keys):
+        answer.sql, answer.error = generated[key]
+        if answer.sql is None:
+            continue
+        df = results.get(normalize_sql(answer.sql))
+        if answer.sql in rejected:
+            answer.error = rejected[answer.sql]
+        elif df is None:
+            answer.error = "This operation modifies the database and was not run; confirm it and run it on its own."
+        elif result_error(df) is not None:
+            answer.error = result_error(df)
+        else:
+            answer.result = df
+    return answers
+
+
+# --- Merged execution ---
+def merged_statement(statements) -> str:
+    """One SELECT returning ``(idx, columns, rows)`` for each statement, each wrapped in its own CTE.
+
+    ``columns`` is the JSON array of output names, read from a NULL row so it
+    survives an empty result; each row is a JSON array in the same order.
+    Both go through json_each on ``json`` (not jsonb), which keeps duplicate
+    names and their order.
+    """
+    ctes = ",\n".join(f"q{i} AS (\n{sql}\n)" for i, sql in enumerate(statements))
+    fields = "json_each(to_json({})) WITH ORDINALITY AS c(key, value, n)"
+    selects = "\nUNION ALL\n".join(
+        f"SELECT {i} AS idx, "
+        f"(SELECT json_agg(c.key ORDER BY c.n) FROM (SELECT q{i}.* FROM (SELECT 1) AS one LEFT JOIN q{i} ON false) AS h, "
+        f"{fields.format('h')}) AS columns, "
+        f"(SELECT json_agg((SELECT json_agg(c.value ORDER BY c.n) FROM {fields.format(f'q{i}')})) FROM q{i}) AS rows"
+        for i in range(len(statements))
+    )
+    return f"WITH {ctes}\n{selects}"
+
+
+def merged_analysis(analyses) -> Analysis:
+    """Analysis of the merged statement, for EXPLAIN-based cost checks."""
+    return Analysis(
+        sql=merged_statement([analysis.sql for analysis in analyses]),
+        statement_type="Select",
+        is_read=True,
+        tables=set().union(*(analysis.tables for analysis in analyses)),
+    )
+
+
+def run_merged(cursor, merged: Analysis, count: int) -> list:
+    """Execute a merged_analysis() statement; returns a DataFrame per original query.
+
+    Column names, their order (duplicates included) and the columns of an
+    empty result match running each query on its own, but values arrive as
+    JSON: dates and timestamps come back as ISO strings, numerics as floats
+    or ints rather than Decimals, and bytea as hex strings.
+    """
+    cursor.execute(merged.sql)
+    frames = [None] * count
+    for idx, columns, rows in cursor.fetchall():
+        columns, rows = (json.loads(value) if isinstance(value, str) else value for value in (columns, rows))
+        frames[idx] = pd.DataFrame([row or [] for row in rows or []], columns=columns or [])
+    return frames
@@ -0,0 +1,143 @@
+"""Cold-start benchmark: how long ``import chat_ui`` takes, and what it pulls in.
+
+Runs ``python -X importtime -c "import chat_ui"`` in fresh interpreters and
+reports the interpreter wall time, the import time of chat_ui and the
+slowest of its direct imports (cumulative, median over runs). Heavy
+dependencies that chat_ui loads on first use must not show up at import;
+any that do are listed and fail the run, as does a slowdown against the
+stored baseline.
+
+    python docs/bench_startup.py --save-baseline
+    python docs/bench_startup.py             # exits 1 on a regression
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+DOCS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(DOCS_DIR, "bench_startup_baseline.json")
+
+# Deferred by chat_ui (see lazy_imports.py); importing chat_ui should not load them
+DEFERRED = ("streamlit", "pandas", "numpy", "pyarrow", "openai", "sqlglot", "tiktoken", "psycopg2")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def parse_importtime(stderr: str, module: str):
+    """``(cumulative ms of module, {direct import: cumulative ms}, every module name)`` from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4), int(match.group(2)) / 1000))
+    # A module's own imports are listed before it, indented one level deeper
+    children = []
+    for indent, name, cumulative in entries:
+        if name == module:
+            depth = min((i for i, _, _ in children if i > indent), default=None)
+            direct = {}
+            for i, child, ms in children:
+                if i == depth:
+                    direct[child] = direct.get(child, 0.0) + ms
+            return cumulative, direct, {name for _, name, _ in entries}
+        children.append((indent, name, cumulative))
+    raise ValueError(f"{module} not found in -X importtime output")
+
+
+def measure(module: str, python: str = sys.executable) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [DOCS_DIR, os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=DOCS_DIR, env=env, capture_output=True, text=True,
+    )
+    wall = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    import_ms, top, modules = parse_importtime(proc.stderr, module)
+    return {"wall_ms": wall, "import_ms": import_ms, "top": top, "modules": modules}
+
+
+def run(module: str, runs: int) -> dict:
+    measure(module)  # warm the bytecode and filesystem caches
+    samples = [measure(module) for _ in range(runs)]
+    names = set().union(*(sample["top"] for sample in samples))
+    top = {name: statistics.median(sample["top"].get(name, 0.0) for sample in samples) for name in names}
+    loaded = set().union(*(sample["modules"] for sample in samples))
+    return {
+        "meta": {"module": module, "runs": runs, "python": sys.version.split()[0]},
+        "wall_ms": statistics.median(sample["wall_ms"] for sample in samples),
+        "import_ms": statistics.median(sample["import_ms"] for sample in samples),
+        "top": dict(sorted(top.items(), key=lambda item: -item[1])),
+        "deferred_loaded": sorted(
+            name for name in DEFERRED if any(m == name or m.startswith(name + ".") for m in loaded)
+        ),
+    }
+
+
+def compare(results, baseline, tolerance, floor_ms=5.0):
+    """Regressions as text lines: a median worse than baseline by more than ``tolerance`` (and ``floor_ms``)."""
+    regressions = []
+    for key in ("wall_ms", "import_ms"):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        current = results[key]
+        if current > previous * (1 + tolerance) and current - previous > floor_ms:
+            regressions.append(f"{key}: {current:.1f}ms vs {previous:.1f}ms baseline")
+    return regressions
+
+
+def print_report(results, limit):
+    meta = results["meta"]
+    print(f"import {meta['module']} (python {meta['python']}, median of {meta['runs']} runs)")
+    print(f"{'wall time (ms)':40} {results['wall_ms']:9.1f}")
+    print(f"{'import time (ms)':40} {results['import_ms']:9.1f}")
+    for name, ms in list(results["top"].items())[:limit]:
+        print(f"  {name[:38]:38} {ms:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="chat_ui")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of direct imports to list")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.module, args.runs)
+    print_report(results, args.top)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = False
+    if results["deferred_loaded"]:
+        print("Loaded at import but should be deferred: " + ", ".join(results["deferred_loaded"]))
+        failed = True
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            failed = True
+        else:
+            print("No regressions against the baseline.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
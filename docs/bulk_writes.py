@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from decimal import Decimal
+from io import StringIO
+
+from lazy_imports import lazy_import
+from sql_guard import SQLRejected, analyze, check_cost, explain, set_statement_timeout
+
+pd = lazy_import("pandas")
+pgextras = lazy_import("psycopg2.extras")
+pgsql = lazy_import("psycopg2.sql")
+sqlglot = lazy_import("sqlglot")
+exp = lazy_import("sqlglot.expressions")
+
+# Columns row-oriented inserts may fill, per table (ids and created_at come from defaults)
+BULK_COLUMNS = {
+    "extracted2": ("key", "value", "filename", "page_label", "page_confidence", "page_num"),
+    "entities": ("entity_type", "entity_name", "additional_info"),
+    "page_entity_crosswalk": ("page_id", "entity_id"),
+}
+
+
+@dataclass
+class BulkInsert:
+    """Rows for a BULK_COLUMNS table: tuples in ``columns`` order, or dicts keyed by column."""
+
+    table: str
+    rows: list
+    columns: tuple = None  # defaults to every BULK_COLUMNS column of the table
+
+
+@dataclass
+class WriteResult:
+    statement: str
+    statement_type: str = None
+    rows_affected: int = None
+    status: str = "skipped"  # 'success', 'error', 'rolled_back' or 'skipped'
+    error: str = None
+    method: str = None  # 'execute', 'values' (execute_values) or 'copy'
+
+
+def affected_rows(cursor):
+    """Rows changed by the cursor's last statement; None when the server does not report it (DDL)."""
+    return cursor.rowcount if cursor.rowcount >= 0 else None
+
+
+def write_frame(results) -> pd.DataFrame:
+    """Per-statement outcome of run_writes as a DataFrame, one row per write."""
+    return pd.DataFrame(
+        [(r.statement, r.statement_type, r.rows_affected, r.status, r.error) for r in results],
+        columns=["statement", "statement_type", "rows_affected", "status", "error"],
+    ).astype({"rows_affected": "Int64"})
+
+
+# --- Literal INSERT statements ---
+def _literal(node):
+    if isinstance(node, exp.Null):
+        return None
+    if isinstance(node, exp.Boolean):
+        return node.this
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        return int(node.this) if re.fullmatch(r"\d+", node.this) else Decimal(node.this)
+    if isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal) and not node.this.is_string:
+        return -_literal(node.this)
+    raise ValueError("not a literal")
+
+
+def literal_insert(sql: str):
+    """``(table, columns, rows)`` for ``INSERT INTO <bulk table> (cols) VALUES ...`` of plain literals, else None.
+
+    Only statements whose effect is exactly "add these rows" qualify: no
+    ON CONFLICT, RETURNING, CTEs or expressions in the values.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return None
+    if not isinstance(tree, exp.Insert) or any(tree.args.get(arg) for arg in ("conflict", "returning", "with")):
+        return None
+    target, values = tree.this, tree.expression
+    if not (isinstance(target, exp.Schema) and isinstance(target.this, exp.Table) and isinstance(values, exp.Values)):
+        return None
+    table = target.this
+    if table.db not in ("", "public") or table.name not in BULK_COLUMNS:
+        return None
+    columns = tuple(column.name for column in target.expressions)
+    if not columns or not set(columns) <= set(BULK_COLUMNS[table.name]):
+        return None
+    rows = []
+    for row in values.expressions:
+        if not isinstance(row, exp.Tuple) or len(row.expressions) != len(columns):
+            return None
+        try:
+            rows.append(tuple(_literal(value) for value in row.expressions))
+        except ValueError:
+            return None
+    return table.name, columns, rows
+
+
+# --- Execution ---
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def insert_rows(cursor, table: str, columns, rows, method: str = "values", page_size: int = 1000) -> int:
+    """Insert ``rows`` into ``table`` with execute_values or ``COPY FROM STDIN``; returns the row count."""
+    if table not in BULK_COLUMNS or not set(columns) <= set(BULK_COLUMNS[table]):
+        raise SQLRejected(f"Bulk inserts into {table} ({', '.join(columns)}) are not supported.")
+    rows = [tuple(row.get(column) for column in columns) if isinstance(row, dict) else tuple(row) for row in rows]
+    if not rows:
+        return 0
+    target = pgsql.SQL("{} ({})").format(
+        pgsql.Identifier(table), pgsql.SQL(", ").join(map(pgsql.Identifier, columns))
+    )
+    if method == "copy":
+        buffer = StringIO("".join("\t".join(map(_copy_value, row)) + "\n" for row in rows))
+        cursor.copy_expert(pgsql.SQL("COPY {} FROM STDIN").format(target).as_string(cursor), buffer)
+    else:
+        pgextras.execute_values(
+            cursor, pgsql.SQL("INSERT INTO {} VALUES %s").format(target).as_string(cursor), rows, page_size=page_size
+        )
+    return len(rows)
+
+
+def _prepare(writes, results):
+    """Validate the writes and group them into steps: lists of (index, kind, payload)."""
+    steps = []
+    for i, write in enumerate(writes):
+        if isinstance(write, BulkInsert):
+            columns = tuple(write.columns or BULK_COLUMNS.get(write.table, ()))
+            results[i] = WriteResult(f"INSERT INTO {write.table} ({', '.join(columns)}) VALUES %s", "Insert")
+            steps.append([(i, "rows", (write.table, columns, list(write.rows)))])
+            continue
+        results[i] = WriteResult(write)
+        try:
+            analysis = analyze(write)
+        except SQLRejected as e:
+            results[i].status, results[i].error = "error", str(e)
+            continue
+        results[i].statement_type = analysis.statement_type
+        if analysis.is_read:
+            results[i].status, results[i].error = "error", "Only writes can be run as a bulk write."
+            continue
+        parsed = literal_insert(analysis.sql)
+        if parsed is None:
+            steps.append([(i, "sql", analysis)])
+            continue
+        # Consecutive literal INSERTs into the same table and columns go out together
+        previous = steps[-1] if steps else None
+        if (previous and previous[-1][0] == i - 1 and previous[-1][1] == "literal"
+                and previous[-1][2][:2] == parsed[:2]):
+            previous.append((i, "literal", parsed))
+        else:
+            steps.append([(i, "literal", parsed)])
+    return steps
+
+
+def _run_step(cursor, step, results, max_cost, copy_threshold, page_size):
+    kind = step[0][1]
+    if kind == "sql":
+        i, _, analysis = step[0]
+        if max_cost is not None:
+            explain(cursor, analysis)
+            check_cost(analysis, max_cost)
+        cursor.execute(analysis.sql)
+        results[i].rows_affected, results[i].method = affected_rows(cursor), "execute"
+    elif kind == "rows":
+        i, _, (table, columns, rows) = step[0]
+        method = "copy" if len(rows) >= copy_threshold else "values"
+        results[i].rows_affected = insert_rows(cursor, table, columns, rows, method, page_size)
+        results[i].method = method
+    else:
+        table, columns, _ = step[0][2]
+        rows = [row for _, _, (_, _, statement_rows) in step for row in statement_rows]
+        method = "copy" if len(rows) >= copy_threshold else "values"
+        insert_rows(cursor, table, columns, rows, method, page_size)
+        for i, _, (_, _, statement_rows) in step:
+            results[i].rows_affected, results[i].method = len(statement_rows), method
+    for i, _, _ in step:
+        results[i].status = "success"
+
+
+def run_writes(conn, writes, on_error: str = "rollback", statement_timeout_ms: int = None, max_cost: float = None,
+               copy_threshold: int = 5000, page_size: int = 1000) -> list:
+    """Run confirmed writes in one transaction, each under its own savepoint; returns a WriteResult per write.
+
+    ``writes`` are SQL statements and BulkInserts. Consecutive literal
+    ``INSERT ... VALUES`` statements into the same BULK_COLUMNS table and
+    columns are sent as one execute_values call, and any insert of at least
+    ``copy_threshold`` rows uses ``COPY FROM STDIN``. Reads are rejected.
+
+    With ``on_error="rollback"`` the first failure (including a statement
+    that fails validation) rolls the whole transaction back: earlier writes
+    are reported ``rolled_back`` and later ones ``skipped``. With
+    ``on_error="continue"`` only the failing statement is undone and the
+    rest are committed.
+    """
+    if on_error not in ("rollback", "continue"):
+        raise ValueError("on_error must be 'rollback' or 'continue'")
+    writes = list(writes)
+    results = [None] * len(writes)
+    steps = _prepare(writes, results)
+    if on_error == "rollback" and any(result.status == "error" for result in results):
+        return results
+
+    failed = False
+    try:
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor, statement_timeout_ms)
+            pending = list(steps)
+            while pending:
+                step = pending.pop(0)
+                cursor.execute("SAVEPOINT bulk_write")
+                try:
+                    _run_step(cursor, step, results, max_cost, copy_threshold, page_size)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT bulk_write")
+                    if on_error == "continue" and len(step) > 1:
+                        for i, _, _ in step:
+                            results[i].status, results[i].rows_affected = "skipped", None
+                        pending[:0] = [[item] for item in step]  # retry one by one to find the failing statement
+                        continue
+                    for i, _, _ in step:
+                        results[i].status, results[i].rows_affected, results[i].error = "error", None, str(e)
+                    if on_error == "rollback":
+                        failed = True
+                        break
+                    continue
+                cursor.execute("RELEASE SAVEPOINT bulk_write")
+        if failed:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if failed:
+        for result in results:
+            if result.status == "success":
+                result.status = "rolled_back"
+    return results
@@ -1,313 +1,800 @@
+from __future__ import annotations
+
 import os
-import streamlit as st
-import pandas as pd
-import json
-import re
+import atexit
+import contextlib
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from openai import OpenAI
-import psycopg2
-import psycopg2.extras
-
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-
-# Define the database schema for reference (for generating SQL queries)
-SCHEMA = r"""
-Table: pages(
-    /* Table that stores raw information about each page in 
-    a document and information on whether/how each page was classified */
-    filename TEXT,          /* File name of the uploaded document */
-    preprocessed TEXT,      /* File path of a page's final preprocessed image */
-    page_number INTEGER,    /* Page number in the document */
-    image_width REAL,       /* Width of the page image */
-    image_height REAL,      /* Height of the page image */
-    lines TEXT,             /* Extracted lines of text */
-    words TEXT,             /* Extracted words */
-    bboxes TEXT,            /* Bounding boxes of words */
-    normalized_bboxes TEXT, /* Normalized bounding boxes */
-    tokens TEXT,            /* Extracted tokens */
-    words_for_clf TEXT,     /* Words used for classification */
-    processing_time REAL,   /* Time taken for processing */
-    clf_type TEXT,          /* Type of classifier used */
-    page_label TEXT,        /* Predicted label for the page */
-    page_confidence REAL,        /* Confidence score for the label */
-    created_at DATETIME default current_timestamp /* Timestamp of creation */
-)
-Table: extracted2(
-    /* Table stores extracted key-value pairs from the document
-       and contains structured information extracted from the pages
-       in the document. */
-    key TEXT,           /* Designated key extracted from the page (e.g., first_name, gross_revenue, etc.) */
-    value TEXT,         /* Extracted value corresponding to the key */
-    filename TEXT,      /* Foreign key to pages.preprocessed */
-    page_label TEXT,    /* Type of page -- correspondes to pages.page_label */
-    page_confidence REAL, /* Confidence score of page_label -- correspondes to pages.page_confidence */
-    page_num INTEGER,   /* Page number in the document */
-    created_at DATETIME default current_timestamp /* Timestamp of creation */
-)
-Table: entities(
-    /* Table to store unique person or business entities */
-    entity_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    entity_type TEXT,         /* 'person' or 'business' */
-    entity_name TEXT,         /* Full name or business name */
-    additional_info TEXT,     /* JSON or additional metadata (e.g., normalized address, EIN, SSN) */
-    created_at DATETIME default current_timestamp /* Timestamp of creation */
-)
-Table: page_entity_crosswalk(
-    /* Table to link pages to entities (supports many-to-many relationships) */
-    crosswalk_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    page_id INTEGER,          /* Foreign key to pages (e.g., pages.id) */
-    entity_id INTEGER,        /* Foreign key to entities (entities.entity_id) */
-    created_at DATETIME default current_timestamp /* Timestamp of creation */
+
+from batch_questions import answer_batch, merged_analysis, run_merged
+from bulk_writes import affected_rows, run_writes, write_frame
+from db_pool import ConnectionPool
+from entity_resolver import EntityResolver, entity_hint
+from example_store import ExampleStore
+from instrumentation import (
+    ChatCallInfoWriter, Instrumentation, MetricsRegistry, annotate, annotate_usage, record_frame, serve_metrics,
 )
-Table: conversations (
-    id SERIAL PRIMARY KEY, 
-    title TEXT,
-    conversation TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-"""
+from lazy_imports import cached_resource, lazy_import
+from message_store import create_conversation, json_loads, load_transcript, load_transcripts, save_new_messages
+from nl_sql_cache import MemoryBackend, NLSQLCache, SQLiteBackend, ShingleMatcher
+from pivot_views import PIVOT_TABLES, PivotAccelerator, invalidates_pivots
+from prompt_resources import EXAMPLES, SCHEMA
+from result_cache import ResultCache, is_cacheable, is_write, normalize_sql, referenced_tables
+from result_store import ResultStore
+from result_workers import ResultWorkers
+from schema_catalog import SchemaCatalog, parse_schema_annotations
+from shared_cache import connect as connect_shared_caches, parse_address
+from sql_guard import analyze, check_cost, explain, set_statement_timeout
+from sql_prompt import PromptAssets, PromptBuilder, StreamingSQLExtractor, cleanup_sql_query, describe_usage, extract_sql
+from sql_stream import QueryStream
+
+# Heavy dependencies are imported on first use (see bench_startup.py)
+st = lazy_import("streamlit")
+pd = lazy_import("pandas")
+psycopg2 = lazy_import("psycopg2")
+pgextras = lazy_import("psycopg2.extras")
+
+# Only warnings are logged unless CHAT_DB_LOG_LEVEL is lowered (INFO, DEBUG)
+logger = logging.getLogger("chat_db")
+logger.setLevel(os.environ.get("CHAT_DB_LOG_LEVEL", "WARNING").upper())
+
+# Clients, pools, caches and background threads below are memoized with
+# cached_resource so Streamlit reruns reuse them; database connections and the
+# OpenAI client are only created on first use.
 
 # --- Supabase Connection using psycopg2 ---
-def get_connection():
-    user = os.environ.get("SUPABASE_USER")
-    password = os.environ.get("SUPABASE_PASSWORD")
-    host = os.environ.get("SUPABASE_HOST")
-    port = os.environ.get("SUPABASE_PORT", 5432)
-    dbname = os.environ.get("SUPABASE_DBNAME")
-    conn = psycopg2.connect(
-        user=user,
-        password=password,
-        host=host,
-        port=port,
-        dbname=dbname
-    )
+def _connect_kwargs() -> dict:
+    return {
+        "user": os.environ.get("SUPABASE_USER"),
+        "password": os.environ.get("SUPABASE_PASSWORD"),
+        "host": os.environ.get("SUPABASE_HOST"),
+        "port": os.environ.get("SUPABASE_PORT", 5432),
+        "dbname": os.environ.get("SUPABASE_DBNAME"),
+    }
+
+def _connect():
+    conn = psycopg2.connect(**_connect_kwargs())
     return conn
 
+@cached_resource
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use."""
+    return ConnectionPool(
+        _connect,
+        minconn=int(os.environ.get("SUPABASE_POOL_MIN", 1)),
+        maxconn=int(os.environ.get("SUPABASE_POOL_MAX", 10)),
+        idle_timeout=float(os.environ.get("SUPABASE_POOL_IDLE_TIMEOUT", 300)),
+    )
+
+# Per-stage timing, token and row metrics: aggregated in memory (served on
+# METRICS_PORT when set) and written to chat_call_info in batches.
+@cached_resource
+def get_metrics() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    if os.environ.get("METRICS_PORT"):
+        serve_metrics(registry, int(os.environ["METRICS_PORT"]), host=os.environ.get("METRICS_HOST", "127.0.0.1"))
+    return registry
+
+@cached_resource
+def get_call_info_writer():
+    """Batched chat_call_info writer, or None when CHAT_CALL_INFO_LOGGING=0."""
+    if os.environ.get("CHAT_CALL_INFO_LOGGING", "1") == "0":
+        return None
+    # Uses the pool directly so the writer's own checkouts are not recorded
+    writer = ChatCallInfoWriter(
+        lambda: get_pool().connection(),
+        batch_size=int(os.environ.get("CHAT_CALL_INFO_BATCH", 100)),
+        interval=float(os.environ.get("CHAT_CALL_INFO_INTERVAL", 5)),
+        stages={"convert_to_sql", "run_sql_query", "run_sql_writes", "save_conversation", "load_conversations"},
+    )
+    atexit.register(writer.close)
+    return writer
+
+def _add_instrumentation_hooks(instrumentation: Instrumentation):
+    instrumentation.add_hook(get_metrics())
+    if get_call_info_writer() is not None:
+        instrumentation.add_hook(get_call_info_writer())
+
+@cached_resource
+def get_instrumentation() -> Instrumentation:
+    """Stage instrumentation; the metrics server and chat_call_info writer start with the first recorded call."""
+    return Instrumentation(setup=_add_instrumentation_hooks)
+
+instrumentation = get_instrumentation()
+
+@contextlib.contextmanager
+def get_connection():
+    """Check out a pooled connection: use as ``with get_connection() as conn:``."""
+    with contextlib.ExitStack() as stack:
+        with instrumentation.span("get_connection"):  # times the checkout only
+            conn = stack.enter_context(get_pool().connection())
+        yield conn
+
+# Initialize the OpenAI client on first use (importing openai is slow)
+MODEL = "gpt-4o"
+
+@cached_resource
+def get_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
 # --- Conversation Persistence Functions ---
-def save_conversation(conversation, title="Conversation"):
-    """Save a conversation (list of messages) to the database."""
-    print(conversation)
+def _format_timestamp(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+def _decode_conversation(data):
+    """Decode a stored transcript; values that are already a dict/list are used directly."""
+    if isinstance(data, (str, bytes)):
+        return json_loads(data)
+    return data
+
+@instrumentation.instrument("save_conversation", lambda record, conversation_id: annotate(conversation_id=conversation_id))
+def save_conversation(conversation, title="Conversation", conversation_id=None):
+    """Save a conversation (list of messages) to the database and return its id.
+
+    Messages are appended to conversation_messages; pass the id returned by the
+    first save as ``conversation_id`` so later saves only write the new turns.
+    """
+    logger.debug("Saving conversation %s with %d messages", conversation_id, len(conversation))
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Convert the conversation to a JSON-serializable format
-        # This ensures we're working with basic Python types that can be JSON serialized
-        conversation_json = json.dumps(conversation)
-        
-        if title == "Conversation":
-            title = f"Conversation on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        cursor.execute(
-            "INSERT INTO conversations (title, conversation) VALUES (%s, %s)",
-            (title, conversation_json)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Error saving conversation: {e}")
+        with get_connection() as conn:
+            if conversation_id is None:
+                if title == "Conversation":
+                    title = f"Conversation on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                conversation_id = create_conversation(conn, title)
+            written = save_new_messages(conn, conversation_id, conversation)
+            conn.commit()
+        logger.debug("Wrote %d new messages to conversation %s", written, conversation_id)
+        return conversation_id
+    except Exception:
+        logger.exception("Error saving conversation")
         raise  # Re-raise the exception to propagate it to the caller
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
 
+def list_conversations(limit: int = 50, before=None):
+    """List conversation summaries (id, title, created_at), newest first.
+
+    Pages are keyset-based: pass the returned ``next_cursor`` as ``before`` to
+    get the next page; it is None once there are no more conversations.
+    Transcripts are not fetched; use get_conversation() for that.
+    """
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=pgextras.DictCursor) as cursor:
+            if before is None:
+                cursor.execute(
+                    "SELECT id, title, created_at FROM conversations "
+                    "ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (limit + 1,)
+                )
+            else:
+                cursor.execute(
+                    "SELECT id, title, created_at FROM conversations "
+                    "WHERE (created_at, id) < (%s, %s) "
+                    "ORDER BY created_at DESC, id DESC LIMIT %s",
+                    (before[0], before[1], limit + 1)
+                )
+            rows = cursor.fetchall()
+        conn.rollback()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    summaries = [
+        {"id": row['id'], "title": row['title'], "created_at": _format_timestamp(row['created_at'])}
+        for row in rows
+    ]
+    next_cursor = (rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+    logger.debug("Listed %d conversations (more: %s)", len(summaries), has_more)
+    return summaries, next_cursor
+
+def get_conversation(conversation_id):
+    """Load one conversation, including its decoded transcript, or None if it does not exist."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=pgextras.DictCursor) as cursor:
+            cursor.execute(
+                "SELECT id, title, conversation, created_at FROM conversations WHERE id = %s",
+                (conversation_id,)
+            )
+            row = cursor.fetchone()
+        transcript = load_transcript(conn, conversation_id, legacy=row['conversation']) if row else None
+        conn.rollback()
+    if row is None:
+        return None
+    return {
+        "id": row['id'],
+        "title": row['title'],
+        "conversation": transcript,
+        "created_at": _format_timestamp(row['created_at'])
+    }
+
+@instrumentation.instrument("load_conversations", lambda record, conversations: annotate(rows=len(conversations)))
 def load_conversations():
-    """Load all saved conversations from the database."""
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)  # Use DictCursor for easier column access
-    cursor.execute("SELECT id, title, conversation, created_at FROM conversations ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    """Load all saved conversations from the database.
+
+    Prefer list_conversations() + get_conversation(): this fetches and decodes
+    every transcript.
+    """
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=pgextras.DictCursor) as cursor:  # Use DictCursor for easier column access
+            cursor.execute("SELECT id, title, conversation, created_at FROM conversations ORDER BY created_at DESC")
+            rows = cursor.fetchall()
+        # Message rows win over the legacy JSON column, as in message_store.load_transcript
+        transcripts = load_transcripts(conn, [row['id'] for row in rows])
+        conn.rollback()
     conversations = []
     for row in rows:
         try:
-            # Make sure we're properly parsing the JSON string
-            conversation_data = None
-            if isinstance(row['conversation'], str):
-                conversation_data = json.loads(row['conversation'])
-            else:
-                # If it's already a dict/list, use it directly
-                conversation_data = row['conversation']
-            
-            # Debug output
-            print(f"Conversation {row['id']} loaded. Type: {type(conversation_data)}")
-            
-            # Format the created_at timestamp
-            created_at = row['created_at'].isoformat() if hasattr(row['created_at'], 'isoformat') else str(row['created_at'])
-            
+            transcript = transcripts[row['id']]
+            if not transcript and row['conversation'] is not None:
+                transcript = _decode_conversation(row['conversation'])
             conversations.append({
                 "id": row['id'],
                 "title": row['title'],
-                "conversation": conversation_data,
-                "created_at": created_at
+                "conversation": transcript,
+                "created_at": _format_timestamp(row['created_at'])
             })
-        except Exception as e:
-            print(f"Error parsing conversation {row['id']}: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error parsing conversation %s", row['id'])
+    logger.debug("Loaded %d conversations", len(conversations))
     return conversations
 
 # --- Helper Functions for SQL Conversion ---
 
-def cleanup_sql_query(raw_query: str) -> str:
-    # Remove triple backticks or any code fences
-    cleaned = re.sub(r"```(?:sql)?", "", raw_query)
-    cleaned = re.sub(r"```", "", cleaned)
-    return cleaned.strip()
-
-def convert_to_sql(nl_query: str, schema: str) -> str:
-    examples = """
-    Examples of valid queries:
-
-    1) "Show me tax return data on Company XYZ for the last 3 years. Exclude balance sheet items."
-    SELECT e.filename,
-           e.key,
-           e.value,
-           e.page_label,
-           p.created_at,
-           ent.entity_name
-    FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
-    JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-    JOIN entities ent ON pc.entity_id = ent.entity_id
-    WHERE ent.entity_name = 'Company XYZ'
-      AND p.created_at >= DATE('now', '-3 years')
-      AND e.page_label NOT IN ('1120S_bal_sheet', '1065_bal_sheet', '1120_bal_sheet')
-    ORDER BY p.created_at DESC;
-
-    2) "What is the insured property address for Company ABC's insurance?"
-    SELECT DISTINCT e.filename,
-           MAX(CASE WHEN e.key = 'property_address' THEN e.value END) AS property_address,
-           ent.entity_name
-    FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
-    JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-    JOIN entities ent ON pc.entity_id = ent.entity_id
-    WHERE ent.entity_name = 'Company ABC'
-      AND e.page_label IN ('acord_28', 'acord_25')
-    GROUP BY e.filename, ent.entity_name;
-
-    3) "Does AAA Inc. have a lease? What are the lease terms on it?"
-    SELECT e.filename,
-           MAX(CASE WHEN e.key = 'lease_start_date' THEN e.value END) AS lease_start_date,
-           MAX(CASE WHEN e.key = 'lease_end_date' THEN e.value END) AS lease_end_date,
-           MAX(CASE WHEN e.key = 'term_length' THEN e.value END) AS term_length,
-           ent.entity_name
-    FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
-    JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-    JOIN entities ent ON pc.entity_id = ent.entity_id
-    WHERE ent.entity_name = 'AAA Inc.'
-      AND e.page_label = 'lease_document'
-    GROUP BY e.filename, ent.entity_name;
-
-    4) "Who are the owners of MM Corp, and do we have drivers licenses for them?"
-    WITH owners AS (
-        SELECT DISTINCT e.filename,
-               e.value AS owner_name
-        FROM extracted2 e
-        JOIN pages p ON e.filename = p.preprocessed
-        JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-        JOIN entities ent ON pc.entity_id = ent.entity_id
-        WHERE ent.entity_name = 'MM Corp'
-          AND e.key = 'shareholder_name'
-          AND e.page_label IN ('1120S_k1', '1065_k1')
-    ),
-    drivers AS (
-        SELECT DISTINCT ent.entity_name AS person_name
-        FROM extracted2 e
-        JOIN pages p ON e.filename = p.preprocessed
-        JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-        JOIN entities ent ON pc.entity_id = ent.entity_id
-        WHERE e.page_label = 'drivers_license'
-          AND ent.entity_type = 'person'
+# Tables almost every document question joins through
+CORE_TABLES = ("extracted2", "pages", "page_entity_crosswalk", "entities")
+
+@cached_resource
+def get_schema_catalog() -> SchemaCatalog:
+    """Introspected schema, annotated with the comments from the hand-written SCHEMA."""
+    return SchemaCatalog(
+        get_connection,
+        ttl=float(os.environ.get("SCHEMA_CATALOG_TTL", 600)),
+        annotations=parse_schema_annotations(SCHEMA),
+        core_tables=CORE_TABLES,
+        exclude_tables=PIVOT_TABLES,
     )
-    SELECT o.owner_name,
-           CASE WHEN d.person_name IS NOT NULL THEN 'Yes' ELSE 'No' END AS has_drivers_license
-    FROM owners o
-    LEFT JOIN drivers d ON o.owner_name = d.person_name;
-
-    5) "Do we have a certificate of good standing for JJ LLC?"
-    SELECT e.filename,
-           MAX(CASE WHEN e.key = 'business_name' THEN e.value END) AS business_name,
-           MAX(CASE WHEN e.key = 'current_standing' THEN e.value END) AS current_standing,
-           MAX(CASE WHEN e.key = 'date_incorporated' THEN e.value END) AS date_incorporated,
-           ent.entity_name
-    FROM extracted2 e
-    JOIN pages p ON e.filename = p.preprocessed
-    JOIN page_entity_crosswalk pc ON p.id = pc.page_id
-    JOIN entities ent ON pc.entity_id = ent.entity_id
-    WHERE ent.entity_name = 'JJ LLC'
-      AND e.page_label = 'certificate_of_good_standing'
-    GROUP BY e.filename, ent.entity_name;
-    """
 
-    prompt = f"""You are an expert data scientist specialized in SQL query generation. Analyze the provided PostgreSQL database schema and think step-by-step to produce precise and optimized SQL queries.
+def current_schema(nl_query: str = None) -> str:
+    """Schema text for the prompt, pruned to the question's tables when SCHEMA_PRUNE is set."""
+    try:
+        catalog = get_schema_catalog()
+        if nl_query and os.environ.get("SCHEMA_PRUNE"):
+            return catalog.render_for(nl_query)
+        return catalog.render()
+    except Exception as e:
+        logger.warning("Error reading schema catalog, using built-in SCHEMA: %s", e)
+        return SCHEMA
 
-    Database Schema:
-    {schema}
+@cached_resource
+def get_example_store():
+    """Retrieval store of verified examples (EXAMPLE_STORE_DIR), seeded with the built-in ones."""
+    path = os.environ.get("EXAMPLE_STORE_DIR")
+    if not path:
+        return None
+    store = ExampleStore(path)
+    if not len(store):
+        store.add(EXAMPLES)
+    return store
 
-    Generate only valid PostgreSQL SQL queries (SELECT, CREATE, UPDATE, DELETE, DROP, etc.). For queries tagged as [complex query], carefully review the schema and consider joining multiple tables. Use information_schema for metadata queries when necessary.
+@cached_resource
+def get_prompt_assets() -> PromptAssets:
+    """Precompiled prompt token counts (PROMPT_ASSETS_PATH), so new processes skip loading the tokenizer."""
+    return PromptAssets(os.environ.get(
+        "PROMPT_ASSETS_PATH", os.path.join(tempfile.gettempdir(), "chat_db_prompt_assets.json")
+    ))
 
-    Examples:
-    {examples}
+@cached_resource(max_entries=32)
+def get_prompt_builder(schema: str) -> PromptBuilder:
+    """Prompt builder for a schema; the static prefix is compiled once and reused."""
+    budget = os.environ.get("PROMPT_TOKEN_BUDGET")
+    return PromptBuilder(
+        schema,
+        EXAMPLES,
+        model=MODEL,
+        token_budget=int(budget) if budget else None,
+        example_store=get_example_store(),
+        top_k=int(os.environ.get("EXAMPLE_TOP_K", 3)),
+        assets=get_prompt_assets(),
+    )
 
-    Write a SQL query to answer the following natural language request:
-    \"\"\"{nl_query}\"\"\"
+SHARED_CACHE_ADDRESS = os.environ.get("SHARED_CACHE_ADDRESS")
 
-    Your answer must be a single, valid PostgreSQL SQL query with no additional commentary.
-    """
+@cached_resource
+def get_shared_caches():
+    """(result cache, NL->SQL backend) from the shared_cache server at SHARED_CACHE_ADDRESS, or None."""
+    if not SHARED_CACHE_ADDRESS:
+        return None
+    try:
+        return connect_shared_caches(
+            parse_address(SHARED_CACHE_ADDRESS), os.environ.get("SHARED_CACHE_AUTHKEY", "").encode()
+        )
+    except Exception as e:
+        logger.warning("Shared cache server unavailable, using process-local caches: %s", e)
+        return None
 
+# Completions are requested with temperature=0, so a cached answer for the same
+# question and prompt prefix (schema, model and examples) is as good as a fresh one.
+@cached_resource
+def get_sql_cache() -> NLSQLCache:
+    """NL->SQL cache built from environment settings."""
+    path = os.environ.get("NL_SQL_CACHE_PATH")
+    ttl = float(os.environ["NL_SQL_CACHE_TTL"]) if os.environ.get("NL_SQL_CACHE_TTL") else None
+    if get_shared_caches() is not None:
+        backend = get_shared_caches()[1]
+    elif path:
+        backend = SQLiteBackend(path, ttl=ttl)
+    else:
+        backend = MemoryBackend(max_entries=int(os.environ.get("NL_SQL_CACHE_SIZE", 1024)), ttl=ttl)
+    threshold = os.environ.get("NL_SQL_CACHE_SIMILARITY")
+    matcher = ShingleMatcher(threshold=float(threshold)) if threshold else None
+    return NLSQLCache(backend, matcher)
 
-    response = client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model="gpt-4o",
-        temperature=0,
+@cached_resource
+def get_entity_resolver():
+    """Index of entity names for resolving the ones a question mentions (ENTITY_RESOLVER), or None."""
+    if not os.environ.get("ENTITY_RESOLVER"):
+        return None
+    return EntityResolver(
+        get_connection,
+        min_interval=float(os.environ.get("ENTITY_RESOLVER_INTERVAL", 30)),
+        threshold=float(os.environ.get("ENTITY_RESOLVER_THRESHOLD", 0.75)),
     )
-    allowed_prefixes = (
-        "select", 
-        "with", 
-        "insert", 
-        "update", 
-        "delete", 
-        "create", 
-        "drop", 
-        "alter", 
-        "desc", 
-        "show",
-        "pragma"
+
+def _entity_context(nl_query: str, builder: PromptBuilder):
+    """(entity id hint for the prompt, NL->SQL cache context); the hint is part of the cache key."""
+    resolver = get_entity_resolver()
+    if resolver is None:
+        return None, builder.fingerprint
+    try:
+        hint = entity_hint(resolver.resolve(nl_query))
+    except Exception as e:
+        logger.warning("Entity resolution failed, prompting without entity ids: %s", e)
+        return None, builder.fingerprint
+    if not hint:
+        return None, builder.fingerprint
+    return hint, builder.fingerprint + ":" + hashlib.sha256(hint.encode("utf-8")).hexdigest()[:16]
+
+@instrumentation.instrument("convert_to_sql")
+def convert_to_sql(nl_query: str, schema: str = None) -> str:
+    if schema is None:
+        schema = current_schema(nl_query)
+    builder = get_prompt_builder(schema)
+    entities, cache_context = _entity_context(nl_query, builder)
+    cached_sql = get_sql_cache().get(nl_query, cache_context)
+    annotate(cache_hit=cached_sql is not None, model_version=MODEL)
+    if cached_sql is not None:
+        return cached_sql
+
+    prompt = builder.build(nl_query, context=entities)
+    response = get_openai_client().chat.completions.create(
+        messages=prompt.messages,
+        model=MODEL,
+        temperature=0,
     )
+    logger.info(describe_usage(prompt, getattr(response, "usage", None)))
+    annotate_usage(getattr(response, "usage", None), MODEL)
     sql_query = response.choices[0].message.content.strip()
-    print(sql_query)
-    sql_query = cleanup_sql_query(sql_query)
-    if not sql_query.lower().startswith(allowed_prefixes):
-        raise ValueError("Generated query does not start with a valid SQL command. Aborting for safety.")
+    logger.debug("Generated SQL: %s", sql_query)
+    sql_query = extract_sql(sql_query)
+    analysis = analyze(sql_query)  # reject multi-statement or unsafe SQL before it is cached or shown
+    annotate(query_type="READ" if analysis.is_read else "WRITE")
+    get_sql_cache().put(nl_query, cache_context, sql_query)
     return sql_query
 
-def run_sql_query(query: str) -> pd.DataFrame:
-    """Execute the given SQL query on the SQLite database and return the results as a DataFrame."""
-    conn = get_connection()
+# Pre-execution limits: planner cost ceiling, LIMIT for unbounded SELECTs, per-statement timeout
+SQL_MAX_COST = float(os.environ["SQL_MAX_COST"]) if os.environ.get("SQL_MAX_COST") else 1_000_000.0
+SQL_AUTO_LIMIT = int(os.environ.get("SQL_AUTO_LIMIT", 1000))
+SQL_STATEMENT_TIMEOUT_MS = int(os.environ.get("SQL_STATEMENT_TIMEOUT_MS", 30000))
+
+@cached_resource
+def get_result_cache():
+    """Result cache shared through the shared_cache server, or a process-local ResultCache."""
+    if get_shared_caches() is not None:
+        return get_shared_caches()[0]
+    return ResultCache(
+        max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        ttl=float(os.environ["RESULT_CACHE_TTL"]) if os.environ.get("RESULT_CACHE_TTL") else None,
+    )
+
+@cached_resource
+def get_pivot_accelerator():
+    """Wide-table accelerator for extracted2 pivots, enabled with PIVOT_VIEWS."""
+    if not os.environ.get("PIVOT_VIEWS"):
+        return None
+    return PivotAccelerator(
+        get_connection,
+        min_hits=int(os.environ.get("PIVOT_VIEWS_MIN_HITS", 3)),
+        create_indexes=bool(os.environ.get("PIVOT_VIEWS_CREATE_INDEXES")),
+        statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS,
+    )
+
+def accelerate_query(sql: str) -> str:
+    """Record ``sql`` in the pivot query log and rewrite it onto a wide table when one covers it."""
+    accelerator = get_pivot_accelerator()
+    if accelerator is None:
+        return sql
     try:
-        if query.strip().lower().startswith(("select", "with")):
-            df = pd.read_sql_query(query, conn)
-        else:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            conn.commit()
-            df = pd.DataFrame({"result": ["Query executed successfully"]})
+        if accelerator.observe(sql):
+            accelerator.schedule()
+        return accelerator.rewrite(sql)
+    except Exception as e:
+        logger.warning("Pivot acceleration failed, running the original query: %s", e)
+        return sql
+
+@instrumentation.instrument("run_sql_query", record_frame)
+def run_sql_query(query: str, cache_result: bool = True, scope=None) -> pd.DataFrame:
+    """Execute the given SQL query on the SQLite database and return the results as a DataFrame.
+
+    ``cache_result=False`` leaves the result cache for the caller to fill;
+    ``scope(conn)``, a context manager, is entered around the statement.
+    """
+    cacheable = is_cacheable(query)
+    if cacheable:
+        snapshot = get_result_cache().snapshot(query)  # before running, so a concurrent write voids the put
+        cached = get_result_cache().get(query)
+        annotate(cache_hit=cached is not None, query_type="READ")
+        if cached is not None:
+            return cached
+    try:
+        analysis = analyze(query, auto_limit=SQL_AUTO_LIMIT)
+        annotate(query_type="READ" if analysis.is_read else "WRITE")
+        if analysis.is_read:
+            analysis.sql = accelerate_query(analysis.sql)
+        with get_connection() as conn, (scope or contextlib.nullcontext)(conn):
+            with conn.cursor() as cursor:
+                set_statement_timeout(cursor, SQL_STATEMENT_TIMEOUT_MS)
+                explain(cursor, analysis)
+            check_cost(analysis, SQL_MAX_COST)
+            if analysis.is_read:
+                df = pd.read_sql_query(analysis.sql, conn)
+            else:
+                with conn.cursor() as cursor:
+                    cursor.execute(analysis.sql)
+                    df = pd.DataFrame({
+                        "statement_type": [analysis.statement_type],
+                        "rows_affected": [affected_rows(cursor)],
+                    })
+                conn.commit()
     except Exception as e:
-        df = pd.DataFrame({"error": [str(e)]})
-    finally:
-        conn.close()
+        return pd.DataFrame({"error": [str(e)]})
+    if cacheable and cache_result:
+        get_result_cache().put(query, df, snapshot)
+    elif is_write(query):
+        _after_write(query)
     return df
 
+def _after_write(query: str):
+    """Invalidate what a successful write may have made stale."""
+    get_result_cache().invalidate_for_write(query)
+    if "extracted2" in referenced_tables(query) and get_pivot_accelerator() is not None and invalidates_pivots(query):
+        # New rows are picked up by the id watermark; updates and deletes need a rebuild
+        get_pivot_accelerator().mark_dirty()
+    if "entities" in referenced_tables(query) and get_entity_resolver() is not None:
+        # New rows are picked up by created_at; anything else may have renamed or removed names
+        get_entity_resolver().mark_dirty(full=not query.strip().lower().startswith("insert"))
+    if query.strip().lower().startswith(("create", "alter", "drop", "truncate", "comment")):
+        get_schema_catalog().mark_stale(referenced_tables(query))
+
+@instrumentation.instrument("run_sql_writes", record_frame)
+def run_sql_writes(writes, on_error: str = "rollback") -> pd.DataFrame:
+    """Run confirmed writes (SQL and bulk_writes.BulkInsert rows) in one transaction.
+
+    Returns one row per write with its statement type, affected rows and
+    status; see bulk_writes.run_writes for ``on_error`` and how inserts are batched.
+    """
+    annotate(query_type="WRITE")
+    with get_connection() as conn:
+        results = run_writes(
+            conn, writes, on_error=on_error, statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS, max_cost=SQL_MAX_COST,
+            copy_threshold=int(os.environ.get("BULK_COPY_THRESHOLD", 5000)),
+        )
+    for result in results:
+        if result.status == "success":
+            _after_write(result.statement)
+    return write_frame(results)
+
+def run_sql_queries_merged(queries) -> list:
+    """Run several SELECTs in one round trip (see batch_questions.run_merged); results are not cached."""
+    analyses = [analyze(query, auto_limit=SQL_AUTO_LIMIT) for query in queries]
+    for analysis in analyses:
+        analysis.sql = accelerate_query(analysis.sql)
+    merged = merged_analysis(analyses)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor, SQL_STATEMENT_TIMEOUT_MS)
+            explain(cursor, merged)
+            check_cost(merged, SQL_MAX_COST)
+            frames = run_merged(cursor, merged, len(analyses))
+        conn.rollback()
+    return frames
+
+@instrumentation.instrument("answer_questions")
+def answer_questions(questions, max_workers: int = None, merge: bool = None) -> list:
+    """Answer several questions at once; returns a BatchAnswer per question, in order.
+
+    SQL is generated on up to BATCH_MAX_WORKERS threads. With ``merge`` (or
+    BATCH_MERGE_QUERIES) the reads run in a single round trip, with values
+    decoded from JSON (see batch_questions.run_merged), otherwise in parallel
+    on pooled connections.
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+    if merge is None:
+        merge = bool(os.environ.get("BATCH_MERGE_QUERIES"))
+    return answer_batch(
+        questions,
+        convert_to_sql,
+        run_sql_query,
+        max_workers=max_workers,
+        run_many=run_sql_queries_merged if merge else None,
+    )
+
+@cached_resource
+def get_speculative_executor() -> ThreadPoolExecutor:
+    """Runs reads dispatched before their completion has finished streaming."""
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("SPECULATIVE_WORKERS", 4)), thread_name_prefix="speculative-sql"
+    )
+
+class SpeculativeQuery:
+    """A read started before its completion finished streaming.
+
+    Runs on the ResultWorkers when CHAT_DB_WORKERS is set, otherwise on the
+    speculative thread pool. Its result only reaches the result cache through
+    ``message()``, once the final SQL is known to match (in worker mode a
+    worker copies the stored result into the shared cache); ``cancel()`` drops it
+    without waiting, interrupting the statement on the server if it is
+    running in this process (a worker that has started finishes unobserved).
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cancelled = False
+        self._snapshot = get_result_cache().snapshot(sql) if is_cacheable(sql) else None
+        self._workers = get_result_workers()
+        if self._workers is not None:
+            self.future = self._workers.submit(sql, cache_result=False)
+        else:
+            self.future = get_speculative_executor().submit(run_sql_query, sql, cache_result=False, scope=self._running)
+
+    @contextlib.contextmanager
+    def _running(self, conn):
+        with self._lock:
+            if self._cancelled:
+                raise RuntimeError("Speculative query cancelled")
+            self._conn = conn
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._conn = None  # back in the pool; cancel() must not touch it any more
+
+    def matches(self, sql: str) -> bool:
+        return normalize_sql(self.sql) == normalize_sql(sql)
+
+    def message(self) -> dict:
+        """Chat message for the result, as from run_query_message."""
+        if self._workers is not None:
+            message = _worker_result_message(self.sql, self.future)
+            outcome = self.future.result()
+            if self._snapshot is not None and "ref" in outcome and not outcome["cache_hit"]:
+                self._workers.cache_stored(self.sql, outcome["ref"], self._snapshot)
+            return message
+        df = self.future.result()
+        if self._snapshot is not None and list(df.columns) != ["error"]:
+            get_result_cache().put(self.sql, df, self._snapshot)
+        return result_message(df)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            self.future.cancel()
+            if self._conn is not None:
+                self._conn.cancel()  # psycopg2: interrupts the running statement from another thread
+
+def _dispatch_speculative(statement: str):
+    """Start running a completed read statement in the background; None if it is not a valid read."""
+    try:
+        sql_query = extract_sql(statement)
+        if not analyze(sql_query).is_read:
+            return None
+    except ValueError:
+        return None
+    return SpeculativeQuery(sql_query)
+
+@instrumentation.instrument("answer_streaming")
+def answer_streaming(nl_query: str, on_partial=None, schema: str = None):
+    """Generate SQL from a streamed completion and start running it before the reply has finished.
+
+    ``on_partial(sql)`` is called with the SQL received so far, code fences
+    removed. As soon as the statement is complete (a top-level ``;`` or the
+    closing fence) a read is dispatched in the background while the rest of
+    the completion streams in. The final SQL is still taken from the whole
+    reply; if it differs, the speculative query is cancelled.
+
+    Returns ``(sql, message)`` with the result's chat message as built by
+    run_query_message; the message is None for writes, which need confirmation.
+    """
+    if schema is None:
+        schema = current_schema(nl_query)
+    builder = get_prompt_builder(schema)
+    entities, cache_context = _entity_context(nl_query, builder)
+    cached_sql = get_sql_cache().get(nl_query, cache_context)
+    annotate(cache_hit=cached_sql is not None, model_version=MODEL)
+    if cached_sql is not None:
+        if on_partial is not None:
+            on_partial(cached_sql)
+        return cached_sql, run_query_message(cached_sql) if analyze(cached_sql).is_read else None
+
+    prompt = builder.build(nl_query, context=entities)
+    stream = get_openai_client().chat.completions.create(
+        messages=prompt.messages,
+        model=MODEL,
+        temperature=0,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    extractor = StreamingSQLExtractor()
+    speculative = None
+    dispatched = False
+    usage = None
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            partial = extractor.feed(chunk.choices[0].delta.content)
+            if on_partial is not None:
+                on_partial(partial)
+            if extractor.complete and not dispatched:
+                dispatched = True
+                speculative = _dispatch_speculative(extractor.statement)
+        logger.info(describe_usage(prompt, usage))
+        annotate_usage(usage, MODEL)
+        logger.debug("Generated SQL: %s", extractor.raw)
+        sql_query = extract_sql(extractor.raw.strip())
+        analysis = analyze(sql_query)
+    except BaseException:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    annotate(query_type="READ" if analysis.is_read else "WRITE")
+    get_sql_cache().put(nl_query, cache_context, sql_query)
+    if speculative is not None:
+        if analysis.is_read and speculative.matches(sql_query):
+            return sql_query, speculative.message()
+        speculative.cancel()  # the rest of the reply changed the statement
+    if not analysis.is_read:
+        return sql_query, None
+    return sql_query, run_query_message(sql_query)
+
+def stream_sql_query(query: str, fetch_size: int = 1000, max_rows: int = None, max_bytes: int = None) -> QueryStream:
+    """Stream a SELECT in DataFrame chunks from a server-side cursor instead of loading it all at once."""
+    if not analyze(query).is_read:
+        raise ValueError("Only SELECT queries can be streamed.")
+    return QueryStream(
+        get_connection, query, fetch_size=fetch_size, max_rows=max_rows, max_bytes=max_bytes,
+        statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS, max_cost=SQL_MAX_COST,
+    )
+
+def show_query_stream(stream: QueryStream) -> pd.DataFrame:
+    """Render a streamed result in Streamlit, showing the first chunk while the rest arrives."""
+    table = st.empty()
+    status = st.empty()
+    chunks = []
+    for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == 1:
+            table.dataframe(chunk)
+        status.caption(f"{stream.rows} rows received...")
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=stream.columns or [])
+    table.dataframe(df)
+    if stream.truncated:
+        status.warning(f"Result truncated after {stream.rows} rows.")
+    else:
+        status.caption(f"{stream.rows} rows.")
+    return df
+
+@cached_resource
+def get_result_store() -> ResultStore:
+    """On-disk store for query results referenced from chat transcripts (RESULT_STORE_DIR)."""
+    return ResultStore(
+        os.environ.get("RESULT_STORE_DIR", os.path.join(tempfile.gettempdir(), "chat_db_results")),
+        fmt=os.environ.get("RESULT_STORE_FORMAT", "arrow"),
+        max_bytes=int(os.environ.get("RESULT_STORE_MAX_BYTES", 1024 * 1024 * 1024)),
+    )
+
+def _error_message(error: str) -> dict:
+    return {"role": "assistant", "message": f"Error running SQL query: {error}"}
+
+def _stored_result_message(ref: dict) -> dict:
+    return {
+        "role": "assistant",
+        "message": f"Result: {ref['rows']} rows, {len(ref['columns'])} columns",
+        "result": ref,
+    }
+
+def result_message(df: pd.DataFrame) -> dict:
+    """Chat message for a query result: a stored reference and a preview rather than the rendered table."""
+    if list(df.columns) == ["error"]:
+        return _error_message(df["error"].iloc[0])
+    return _stored_result_message(get_result_store().put(df))
+
+@cached_resource
+def get_result_workers():
+    """Worker processes that run queries and store their results (CHAT_DB_WORKERS), or None."""
+    processes = int(os.environ.get("CHAT_DB_WORKERS", 0))
+    if not processes:
+        return None
+    store = get_result_store()
+    workers = ResultWorkers(
+        processes,
+        _connect_kwargs(),
+        {"path": store.path, "fmt": store.fmt, "max_bytes": store.max_bytes},
+        auto_limit=SQL_AUTO_LIMIT,
+        statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS,
+        max_cost=SQL_MAX_COST,
+        cache_address=parse_address(SHARED_CACHE_ADDRESS) if get_shared_caches() is not None else None,
+        cache_authkey=os.environ.get("SHARED_CACHE_AUTHKEY", "").encode(),
+    )
+    atexit.register(workers.close)
+    return workers
+
+def run_query_message(query: str) -> dict:
+    """Run ``query`` and build its chat message, in a worker process when CHAT_DB_WORKERS is set.
+
+    Worker mode skips the pivot rewrite and the process-local result cache;
+    share the cache through SHARED_CACHE_ADDRESS instead.
+    """
+    workers = get_result_workers()
+    if workers is None:
+        return result_message(run_sql_query(query))
+    return _worker_result_message(query, workers.submit(query))
+
+def _worker_result_message(query: str, future) -> dict:
+    """Wait for a ResultWorkers future and build its chat message, recorded as a run_sql_query span."""
+    with instrumentation.span("run_sql_query") as record:
+        outcome = future.result()
+        if "error" in outcome:
+            record.status, record.error_message = "error", outcome["error"]
+            return _error_message(outcome["error"])
+        if is_write(query):
+            _after_write(query)
+        ref = outcome["ref"]
+        record.rows, record.bytes, record.cache_hit = ref["rows"], ref["bytes"], outcome["cache_hit"]
+        return _stored_result_message(ref)
+
+def show_result(ref: dict, page_size: int = 100):
+    """Render a stored result one page at a time, or its preview once the stored file is gone."""
+    store = get_result_store()
+    if not store.exists(ref):
+        st.dataframe(pd.DataFrame(ref["preview"], columns=ref["columns"]))
+        st.caption(f"Showing the first {len(ref['preview'])} of {ref['rows']} rows; the full result has expired.")
+        return
+    pages = max(1, -(-ref["rows"] // page_size))
+    page = 0
+    if pages > 1:
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, key=f"page-{ref['result_id']}") - 1
+    st.dataframe(store.page(ref, page, page_size))
+    if pages > 1:
+        st.caption(f"Rows {page * page_size + 1}-{min((page + 1) * page_size, ref['rows'])} of {ref['rows']}")
+
 # # --- Main Chat UI ---
 # st.info('This is a chat interface with the database, focused on answering questions using SQL.')
 # # Sidebar: Display saved conversations
 # st.sidebar.header("Saved Conversations")
-# saved_conversations = load_conversations()
-# conversation_titles = [conv["title"] for conv in saved_conversations]
+# if "conversation_page" not in st.session_state:
+#     st.session_state["conversation_page"] = list_conversations()
+# saved_conversations, next_cursor = st.session_state["conversation_page"]
+# if next_cursor is not None and st.sidebar.button("Load older conversations"):
+#     older, next_cursor = list_conversations(before=next_cursor)
+#     st.session_state["conversation_page"] = (saved_conversations + older, next_cursor)
+#     st.rerun()
+# conversation_options = {f"{conv['title']} (#{conv['id']})": conv["id"] for conv in saved_conversations}
 
 # with st.sidebar:
 #     clear_button = st.button("♻️ Clear Cache", type="primary")
@@ -315,18 +802,20 @@ def run_sql_query(query: str) -> pd.DataFrame:
 #         st.cache_data.clear()
 #         st.success("Cache cleared!")
 
-# selected_conv_title = st.sidebar.selectbox("Select a saved conversation", ["-- New Conversation --"] + conversation_titles)
+# selected_conv_title = st.sidebar.selectbox("Select a saved conversation", ["-- New Conversation --"] + list(conversation_options))
 # if selected_conv_title != "-- New Conversation --":
-#     # Load the selected conversation into session_state
-#     for conv in saved_conversations:
-#         if conv["title"] == selected_conv_title:
-#             st.session_state["chat_history"] = conv["conversation"]
-#             break
+#     # Fetch only the selected transcript into session_state
+#     conv = get_conversation(conversation_options[selected_conv_title])
+#     if conv is not None:
+#         st.session_state["chat_history"] = conv["conversation"]
+#         st.session_state["conversation_id"] = conv["id"]
 
 # # Sidebar: Button to save current conversation
 # if st.sidebar.button("Save Current Conversation"):
 #     if "chat_history" in st.session_state and st.session_state["chat_history"]:
-#         save_conversation(st.session_state["chat_history"])
+#         st.session_state["conversation_id"] = save_conversation(
+#             st.session_state["chat_history"], conversation_id=st.session_state.get("conversation_id")
+#         )
 #         st.sidebar.success("Conversation saved!")
 #     else:
 #         st.sidebar.warning("No conversation to save.")
@@ -340,6 +829,8 @@ def run_sql_query(query: str) -> pd.DataFrame:
 #     content = message.get("message") or message.get("content") or ""
 #     with st.chat_message(role):
 #         st.markdown(content)
+#         if message.get("result"):
+#             show_result(message["result"])
 
 # # Get user input using the chat input widget
 # user_input = st.chat_input("Enter your query about the documents...")
@@ -349,28 +840,29 @@ def run_sql_query(query: str) -> pd.DataFrame:
 #     with st.chat_message("user"):
 #         st.markdown(user_input)
 #     try:
-#         with st.spinner("Generating SQL query..."):
-#             sql_query = convert_to_sql(user_input, SCHEMA)
-#         assistant_message = f"SQL Query: `{sql_query}`"
-#         st.session_state["chat_history"].append({"role": "assistant", "message": assistant_message})
 #         with st.chat_message("assistant"):
-#             st.markdown(assistant_message)
+#             # Show the SQL as it streams in; reads start running before the reply ends
+#             partial_sql = st.empty()
+#             sql_query, message = answer_streaming(
+#                 user_input, on_partial=lambda sql: partial_sql.code(sql, language="sql")
+#             )
+#             assistant_message = f"SQL Query: `{sql_query}`"
+#             partial_sql.markdown(assistant_message)
+#         st.session_state["chat_history"].append({"role": "assistant", "message": assistant_message})
 
-#         # Check if the query is a CRUD operation and ask for confirmation
-#         if sql_query.lower().startswith(("insert", "update", "delete", "create", "drop", "alter")):
+#         # Writes are not run until the user confirms them
+#         if message is None:
 #             st.session_state["pending_sql_query"] = sql_query
 #             st.session_state["awaiting_confirmation"] = True
 #             st.session_state["chat_history"].append({"role": "assistant", "message": "This operation will modify the database. Do you want to proceed? (yes/no)"})
 #             with st.chat_message("assistant"):
 #                 st.markdown("This operation will modify the database. Do you want to proceed? (yes/no)")
 #         else:
-#             with st.spinner("Running SQL query..."):
-#                 result_df = run_sql_query(sql_query)
-#             result_text = result_df.to_string(index=False)
-#             result_message = f"Result:\n```\n{result_text}\n```"
-#             st.session_state["chat_history"].append({"role": "assistant", "message": result_message})
+#             st.session_state["chat_history"].append(message)
 #             with st.chat_message("assistant"):
-#                 st.markdown(result_message)
+#                 st.markdown(message["message"])
+#                 if "result" in message:
+#                     show_result(message["result"])
 #     except Exception as e:
 #         error_message = f"Error generating SQL query: {e}"
 #         st.session_state["chat_history"].append({"role": "assistant", "message": error_message})
@@ -383,12 +875,12 @@ def run_sql_query(query: str) -> pd.DataFrame:
 #     if confirmation_input:
 #         if confirmation_input.lower() == "yes":
 #             with st.spinner("Running SQL query..."):
-#                 result_df = run_sql_query(st.session_state["pending_sql_query"])
-#             result_text = result_df.to_string(index=False)
-#             result_message = f"Result:\n```\n{result_text}\n```"
-#             st.session_state["chat_history"].append({"role": "assistant", "message": result_message})
+#                 message = run_query_message(st.session_state["pending_sql_query"])
+#             st.session_state["chat_history"].append(message)
 #             with st.chat_message("assistant"):
-#                 st.markdown(result_message)
+#                 st.markdown(message["message"])
+#                 if "result" in message:
+#                     show_result(message["result"])
 #         else:
 #             st.session_state["chat_history"].append({"role": "assistant", "message": "Operation cancelled by the user."})
 #             with st.chat_message("assistant"):
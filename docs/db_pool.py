@@ -0,0 +1,217 @@
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, ContextManager
+
+from lazy_imports import lazy_import
+
+psycopg2 = lazy_import("psycopg2")
+pgextensions = lazy_import("psycopg2.extensions")
+pgpool = lazy_import("psycopg2.pool")
+
+# How components reach the database: a zero-argument callable returning a
+# context manager that yields a psycopg2 connection and hands it back (to its
+# pool) on exit, e.g. ``chat_ui.get_connection`` or ``ConnectionPool.connection``.
+# Components taking a ``connection`` argument expect one of these.
+ConnectionFactory = Callable[[], ContextManager["psycopg2.extensions.connection"]]
+
+
+@functools.lru_cache(maxsize=None)
+def _pool_exhausted():
+    class PoolExhausted(pgpool.PoolError):
+        """Raised when no connection becomes available before the checkout timeout."""
+
+    PoolExhausted.__module__, PoolExhausted.__qualname__ = __name__, "PoolExhausted"
+    return PoolExhausted
+
+
+def __getattr__(name):
+    # PoolExhausted subclasses psycopg2's PoolError, so it is only defined once psycopg2 is needed
+    if name == "PoolExhausted":
+        return _pool_exhausted()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are created with ``connect`` (a zero-argument callable) and
+    handed out LIFO so that hot connections stay warm while cold ones age out
+    through idle eviction.
+    """
+
+    def __init__(
+        self,
+        connect,
+        minconn=1,
+        maxconn=10,
+        idle_timeout=300.0,
+        health_check_after=30.0,
+        checkout_timeout=30.0,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: need 0 <= minconn <= maxconn and maxconn >= 1")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._in_use = set()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    # --- Checkout / return ---
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if the pool has room."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            conn = placeholder = None
+            stale = []
+            try:
+                with self._cond:
+                    while True:
+                        if self._closed:
+                            raise psycopg2.InterfaceError("Connection pool is closed")
+                        stale += self._evict_idle_locked()
+                        if self._idle:
+                            # Keep the slot reserved while the health check runs outside the lock.
+                            conn, last_used = self._idle.pop()
+                            self._in_use.add(conn)
+                            break
+                        if len(self._in_use) < self.maxconn:
+                            # Reserve the slot before releasing the lock to connect.
+                            placeholder = object()
+                            self._in_use.add(placeholder)
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise _pool_exhausted()(f"No connection available within {self.checkout_timeout}s")
+                        self._cond.wait(remaining)
+            finally:
+                for old in stale:
+                    self._discard(old)
+
+            if conn is None:
+                break
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+            with self._cond:
+                self._in_use.discard(conn)
+                self._cond.notify()
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use.discard(placeholder)
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._in_use.discard(placeholder)
+            self._in_use.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, rolling back any open or aborted transaction."""
+        with self._cond:
+            if conn not in self._in_use:
+                raise psycopg2.InterfaceError("Connection does not belong to this pool")
+            close = close or self._closed
+        # The rollback is a round trip; the connection keeps its slot until it is back on the idle list.
+        keep = not close and self._reset(conn)
+        with self._cond:
+            self._in_use.discard(conn)
+            keep = keep and not self._closed
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always returns it."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken or bool(conn.closed))
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"idle": len(self._idle), "in_use": len(self._in_use), "max": self.maxconn}
+
+    # --- Internal helpers (only *_locked ones are called with self._cond held) ---
+    def _evict_idle_locked(self):
+        """Take idle connections past idle_timeout off the pool; the caller closes them after unlocking."""
+        stale = []
+        if self.idle_timeout is None:
+            return stale
+        now = time.monotonic()
+        # Oldest connections sit on the left; keep at least minconn around.
+        while (
+            self._idle
+            and len(self._idle) + len(self._in_use) > self.minconn
+            and now - self._idle[0][1] > self.idle_timeout
+        ):
+            conn, _ = self._idle.popleft()
+            stale.append(conn)
+        return stale
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if self.health_check_after is not None and time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _reset(conn):
+        if conn.closed:
+            return False
+        try:
+            status = conn.get_transaction_status()
+            if status == pgextensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != pgextensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
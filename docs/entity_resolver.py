@@ -0,0 +1,228 @@
+import re
+import threading
+import time
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+
+from db_pool import ConnectionFactory
+
+# Legal-form suffixes ignored when matching business names ("AAA Inc." == "AAA")
+_SUFFIXES = frozenset(
+    "inc incorporated llc corp corporation co ltd limited lp llp plc pc pllc".split()
+)
+_STOPWORDS = frozenset(
+    "a an and are as at be by do does for from have has how i in is it me of on or show "
+    "that the their them there this to us was we what when where which who with our "
+    "any all data document documents page pages file files".split()
+)
+
+_ENTITIES_SQL = """
+SELECT entity_id, entity_name, entity_type, created_at
+FROM entities
+WHERE entity_name IS NOT NULL {watermark}
+ORDER BY created_at NULLS FIRST, entity_id
+"""
+
+
+def _tokens(text: str) -> list:
+    text = re.sub(r"['\u2019]s\b", "", text).replace("'", "").replace("\u2019", "")  # AAA Inc.'s -> AAA Inc.
+    return re.findall(r"[A-Za-z0-9]+", text)
+
+
+def normalize_name(name: str) -> str:
+    """Lower-cased alphanumeric tokens without trailing legal-form suffixes: 'MM Corp.' -> 'mm'."""
+    tokens = [token.lower() for token in _tokens(name)]
+    while len(tokens) > 1 and tokens[-1] in _SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class EntityMatch:
+    mention: str  # words of the question that matched
+    entity_ids: list
+    names: list  # stored entity_name of each id
+    entity_type: str
+    score: float  # 1.0 for an exact (normalized) match, trigram similarity otherwise
+    exact: bool = False
+
+
+class EntityResolver:
+    """In-process index of ``entities`` for resolving names mentioned in a question to entity_ids.
+
+    Names are normalized (case, punctuation and legal suffixes such as Inc. or
+    LLC dropped) into an exact-match table and a trigram inverted index whose
+    postings are ``array`` rows. New entities are picked up incrementally by
+    ``(created_at, entity_id)``, at most every ``min_interval`` seconds;
+    renamed or deleted entities need ``mark_dirty(full=True)``, which reloads
+    everything on next use.
+
+    ``connection`` is a db_pool.ConnectionFactory (e.g. ``get_connection``).
+    """
+
+    def __init__(self, connection: ConnectionFactory, min_interval=30.0, threshold=0.75, max_matches=5, max_span=6,
+                 max_posting_fraction=0.05):
+        self._connection = connection
+        self.min_interval = min_interval
+        self.threshold = threshold
+        self.max_matches = max_matches
+        self.max_span = max_span
+        self.max_posting_fraction = max_posting_fraction
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._ids = array("q")
+        self._names = []
+        self._type_codes = array("B")
+        self._types = []  # entity_type by code
+        self._gram_counts = array("H")  # trigrams per normalized name
+        self._exact = defaultdict(lambda: array("I"))  # normalized name -> rows
+        self._postings = defaultdict(lambda: array("I"))  # trigram -> rows
+        self._longest = 1  # tokens in the longest normalized name
+        self._watermark = None  # (created_at, entity_id) of the newest row loaded
+        self._checked_at = None
+        self._dirty = False
+        self._full_reload = True
+
+    def __len__(self):
+        return len(self._ids)
+
+    # --- Loading ---
+    def _add(self, entity_id, name, entity_type):
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+        row = len(self._ids)
+        if entity_type not in self._types:
+            self._types.append(entity_type)
+        self._ids.append(entity_id)
+        self._names.append(name)
+        self._type_codes.append(self._types.index(entity_type))
+        grams = trigrams(normalized)
+        self._gram_counts.append(min(len(grams), 0xFFFF))
+        self._exact[normalized].append(row)
+        for gram in grams:
+            self._postings[gram].append(row)
+        self._longest = max(self._longest, normalized.count(" ") + 1)
+
+    def _load(self, watermark=None):
+        if watermark is None:
+            query, params = _ENTITIES_SQL.format(watermark=""), None
+        else:
+            query = _ENTITIES_SQL.format(watermark="AND (created_at, entity_id) > (%s, %s)")
+            params = watermark
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            conn.rollback()
+        return rows
+
+    def refresh(self, force=False):
+        """Load entities created since the last refresh (or everything after ``mark_dirty(full=True)``)."""
+        with self._lock:
+            due = self._checked_at is None or time.monotonic() - self._checked_at >= self.min_interval
+            if not (force or due or self._dirty):
+                return
+            if self._full_reload or self._watermark is None:
+                rows = self._load()
+                self._reset()
+            else:
+                rows = self._load(self._watermark)
+            for entity_id, name, entity_type, created_at in rows:
+                self._add(entity_id, name, entity_type)
+                if created_at is not None:
+                    self._watermark = (created_at, entity_id)
+            self._checked_at = time.monotonic()
+            self._dirty = False
+            self._full_reload = False
+
+    def mark_dirty(self, full=False):
+        """Refresh on next use; ``full`` also drops the index, for renames and deletes."""
+        with self._lock:
+            self._dirty = True
+            self._full_reload = self._full_reload or full
+
+    # --- Resolution ---
+    def _similar(self, text: str):
+        """Rows whose normalized name shares enough trigrams with ``text``, with their Dice scores."""
+        grams = trigrams(text)
+        limit = max(50, int(len(self._ids) * self.max_posting_fraction))
+        shared = defaultdict(int)
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is not None and len(postings) <= limit:  # very common trigrams say little
+                for row in postings:
+                    shared[row] += 1
+        matches = []
+        for row, count in shared.items():
+            score = 2 * count / (len(grams) + self._gram_counts[row])
+            if score >= self.threshold:
+                matches.append((score, row))
+        return matches
+
+    def resolve(self, question: str) -> list:
+        """EntityMatches for the names mentioned in ``question``, best first, without overlapping words."""
+        self.refresh()
+        with self._lock:
+            return self._resolve(question)
+
+    def _resolve(self, question: str) -> list:
+        raw = _tokens(question)
+        words = [word.lower() for word in raw]
+        # Written like a name: capitalized or containing digits
+        proper = [word != word.lower() or any(c.isdigit() for c in word) for word in raw]
+        candidates = []
+        for start in range(len(words)):
+            for end in range(start + 1, min(len(words), start + self._longest + 2) + 1):
+                span = words[start:end]
+                if span[-1] in _STOPWORDS or all(word in _STOPWORDS or word in _SUFFIXES for word in span):
+                    continue
+                text = normalize_name(" ".join(span))
+                rows = self._exact.get(text)
+                if rows:
+                    if end - start > 1 or proper[start]:  # a lone lower-case word is rarely a name
+                        candidates.append((1.0, end - start, start, end, list(rows), True))
+                elif proper[start] and len(text) >= 4 and end - start <= self.max_span:
+                    similar = self._similar(text)
+                    if similar:
+                        best = max(score for score, _ in similar)
+                        rows = [row for score, row in similar if score == best]
+                        candidates.append((best, end - start, start, end, rows, False))
+
+        matches, used = [], set()
+        for score, _, start, end, rows, exact in sorted(candidates, key=lambda c: (-c[0], -c[1], c[2])):
+            if used.intersection(range(start, end)):
+                continue
+            used.update(range(start, end))
+            matches.append(EntityMatch(
+                mention=" ".join(raw[start:end]),
+                entity_ids=[self._ids[row] for row in rows],
+                names=[self._names[row] for row in rows],
+                entity_type=self._types[self._type_codes[rows[0]]],
+                score=round(score, 3),
+                exact=exact,
+            ))
+            if len(matches) >= self.max_matches:
+                break
+        return matches
+
+
+def entity_hint(matches) -> str:
+    """Prompt lines listing resolved entity_ids, or "" when nothing matched."""
+    if not matches:
+        return ""
+    lines = ["Entities mentioned in the request (filter on entities.entity_id instead of matching entity_name):"]
+    for match in matches:
+        ids = ", ".join(str(entity_id) for entity_id in match.entity_ids)
+        names = "; ".join(dict.fromkeys(match.names))
+        kind = match.entity_type or "entity"
+        lines.append(f'- "{match.mention}" -> entity_id {ids} ({kind}: {names})')
+    return "\n".join(lines)
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import zlib
+
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by do does for from have has how i in is it me of on or show "
+    "that the their them there this to us was we what when where which who with".split()
+)
+
+
+def _terms(text: str):
+    """Unigrams and bigrams of the non-stopword tokens of a question."""
+    tokens = [t for t in re.findall(r"[a-z0-9_]+", text.lower()) if t not in _STOPWORDS]
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class ExampleStore:
+    """Growing library of verified NL/SQL pairs with a hashed TF-IDF index.
+
+    Files under ``path``:
+
+    * ``examples.jsonl`` -- one ``{"question", "sql"}`` pair per line
+    * ``vectors.f32``    -- raw float32 term-frequency rows, appended per example
+                            and memory-mapped for search
+    * ``df.npy``         -- document frequency of every hash bucket
+
+    Term frequencies do not depend on the rest of the collection, so adding
+    examples only appends rows; IDF weighting is applied at query time from
+    ``df.npy``. The store assumes a single writer process.
+    """
+
+    def __init__(self, path: str, dim: int = 4096):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self._examples_path = os.path.join(path, "examples.jsonl")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._df_path = os.path.join(path, "df.npy")
+        self._lock = threading.Lock()
+        self._examples = []
+        self._questions = set()
+        if os.path.exists(self._examples_path):
+            with open(self._examples_path, encoding="utf-8") as f:
+                self._examples = [json.loads(line) for line in f if line.strip()]
+            self._questions = {pair["question"].strip().lower() for pair in self._examples}
+        self._df = np.load(self._df_path) if os.path.exists(self._df_path) else np.zeros(dim, dtype=np.int32)
+        self._vectors = None  # memmap, opened lazily
+        self._weighted_norms = None  # cached per collection size
+        if self._vector_rows() != len(self._examples):
+            self.rebuild()
+
+    def __len__(self):
+        return len(self._examples)
+
+    @property
+    def version(self) -> int:
+        """Changes whenever examples are added; part of the prompt fingerprint."""
+        return len(self._examples)
+
+    # --- Indexing ---
+    def _vectorize(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term in _terms(text):
+            vector[zlib.crc32(term.encode("utf-8")) % self.dim] += 1.0
+        np.log1p(vector, out=vector)  # sublinear TF
+        return vector
+
+    def _vector_rows(self) -> int:
+        if not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self.dim)
+
+    def add(self, pairs) -> int:
+        """Append new pairs (skipping questions already stored); returns how many were added."""
+        with self._lock:
+            new = []
+            for pair in pairs:
+                question = pair["question"].strip()
+                if question.lower() in self._questions:
+                    continue
+                self._questions.add(question.lower())
+                new.append({"question": question, "sql": pair["sql"]})
+            if not new:
+                return 0
+            vectors = np.stack([self._vectorize(pair["question"]) for pair in new])
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            with open(self._examples_path, "a", encoding="utf-8") as f:
+                for pair in new:
+                    f.write(json.dumps(pair) + "\n")
+            self._df += (vectors > 0).sum(axis=0).astype(np.int32)
+            np.save(self._df_path, self._df)
+            self._examples.extend(new)
+            self._vectors = None
+            self._weighted_norms = None
+            return len(new)
+
+    def rebuild(self):
+        """Recompute vectors and document frequencies from examples.jsonl."""
+        with self._lock:
+            if self._examples:
+                vectors = np.stack([self._vectorize(pair["question"]) for pair in self._examples])
+            else:
+                vectors = np.zeros((0, self.dim), dtype=np.float32)
+            with open(self._vectors_path, "wb") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            self._df = (vectors > 0).sum(axis=0).astype(np.int32)
+            np.save(self._df_path, self._df)
+            self._vectors = None
+            self._weighted_norms = None
+
+    # --- Search ---
+    def _open_vectors(self):
+        if self._vectors is None and self._examples:
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._examples), self.dim)
+            )
+        return self._vectors
+
+    def select(self, question: str, k: int = 3) -> list:
+        """Top-k examples by TF-IDF cosine similarity to the question, best first."""
+        with self._lock:
+            vectors = self._open_vectors()
+            if vectors is None or k <= 0:
+                return []
+            n = len(self._examples)
+            idf = np.log((1.0 + n) / (1.0 + self._df)).astype(np.float32) + 1.0
+            if self._weighted_norms is None:
+                self._weighted_norms = np.linalg.norm(vectors * idf, axis=1)
+            query = self._vectorize(question) * idf
+            query_norm = np.linalg.norm(query)
+            if query_norm == 0:
+                return []
+            scores = (vectors @ (query * idf)) / (self._weighted_norms * query_norm + 1e-9)
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [self._examples[i] for i in top if scores[i] > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add verified NL/SQL pairs to an example store.")
+    parser.add_argument("store", help="Example store directory")
+    parser.add_argument("pairs", nargs="?", help='JSON Lines file of {"question", "sql"} pairs')
+    parser.add_argument("--seed", action="store_true", help="Add the built-in examples from prompt_resources")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the index from examples.jsonl")
+    args = parser.parse_args()
+
+    store = ExampleStore(args.store)
+    if args.rebuild:
+        store.rebuild()
+    added = 0
+    if args.seed:
+        from prompt_resources import EXAMPLES
+        added += store.add(EXAMPLES)
+    if args.pairs:
+        with open(args.pairs, encoding="utf-8") as f:
+            added += store.add(json.loads(line) for line in f if line.strip())
+    print(f"Added {added} examples; store now holds {len(store)}.")
+
+
+if __name__ == "__main__":
+    main()
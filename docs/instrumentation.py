@@ -0,0 +1,329 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from db_pool import ConnectionFactory
+from lazy_imports import lazy_import
+
+pgextras = lazy_import("psycopg2.extras")
+
+logger = logging.getLogger("chat_db.instrumentation")
+
+
+@dataclass
+class CallRecord:
+    """One instrumented call. Field names follow the chat_call_info columns."""
+
+    stage: str
+    started_at: float
+    duration_ms: float = 0.0
+    status: str = "success"
+    error_message: str = None
+    conversation_id: int = None
+    model_version: str = None
+    query_type: str = None  # 'READ' or 'WRITE'
+    prompt_tokens: int = None
+    completion_tokens: int = None
+    total_tokens: int = None
+    rows: int = None
+    bytes: int = None
+    cache_hit: bool = None
+
+
+_current_record = contextvars.ContextVar("chat_db_call_record", default=None)
+
+
+def annotate(**fields):
+    """Set fields on the record of the innermost instrumented call (no-op outside one)."""
+    record = _current_record.get()
+    if record is not None:
+        for name, value in fields.items():
+            setattr(record, name, value)
+
+
+def annotate_usage(usage, model=None):
+    """Copy token counts from an OpenAI ``response.usage`` onto the current record."""
+    if usage is None:
+        return
+    annotate(
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
+        total_tokens=getattr(usage, "total_tokens", None),
+        model_version=model,
+    )
+
+
+def record_frame(record: CallRecord, df):
+    """Rows/bytes of a DataFrame result; a lone ``error`` column marks the call as failed."""
+    record.rows = len(df)
+    record.bytes = int(df.memory_usage(index=False, deep=True).sum())
+    if list(df.columns) == ["error"] and len(df):
+        record.status = "error"
+        record.error_message = str(df["error"].iloc[0])
+        record.rows = 0
+
+
+class Instrumentation:
+    """Times pipeline stages and hands a CallRecord for each to the registered hooks.
+
+    Hooks are callables taking a CallRecord; they run on the calling thread, so
+    anything slow (like writing to the database) should only enqueue. A hook
+    that raises is logged and otherwise ignored. ``setup(instrumentation)``,
+    if given, runs once before the first record is emitted, so hooks that
+    start threads or servers are only created once something is measured.
+    """
+
+    def __init__(self, setup=None):
+        self._hooks = []
+        self._setup = setup
+        # Reentrant, so a setup that emits does not wait on itself
+        self._setup_lock = threading.RLock()
+        self._ready = threading.Event()  # set once setup has finished registering hooks
+        if setup is None:
+            self._ready.set()
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _run_setup(self):
+        with self._setup_lock:
+            setup, self._setup = self._setup, None
+            if setup is None:
+                return
+            try:
+                setup(self)
+            except Exception:
+                logger.exception("Instrumentation setup failed")
+            finally:
+                self._ready.set()
+
+    def emit(self, record: CallRecord):
+        if not self._ready.is_set():
+            # Blocks until whichever thread got here first has registered the hooks
+            self._run_setup()
+        for hook in list(self._hooks):
+            try:
+                hook(record)
+            except Exception:
+                logger.exception("Instrumentation hook %r failed", hook)
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **fields):
+        record = CallRecord(stage=stage, started_at=time.time(), **fields)
+        token = _current_record.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record.status = "error"
+            record.error_message = str(e)[:1000]
+            raise
+        finally:
+            record.duration_ms = (time.perf_counter() - start) * 1000
+            _current_record.reset(token)
+            self.emit(record)
+
+    def instrument(self, stage: str, on_result=None):
+        """Decorator form of ``span``; ``on_result(record, result)`` can add result metrics."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage) as record:
+                    result = func(*args, **kwargs)
+                    if on_result is not None:
+                        on_result(record, result)
+                    return result
+            return wrapper
+        return decorator
+
+
+# --- Hooks ---
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsRegistry:
+    """In-process aggregates of CallRecords, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=_DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._calls = defaultdict(int)  # (stage, status) -> count
+        self._duration_sum = defaultdict(float)
+        self._duration_buckets = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._tokens = defaultdict(int)  # (stage, kind) -> tokens
+        self._rows = defaultdict(int)
+        self._bytes = defaultdict(int)
+        self._cache = defaultdict(int)  # (stage, "hit" | "miss") -> count
+
+    def __call__(self, record: CallRecord):
+        seconds = record.duration_ms / 1000
+        with self._lock:
+            self._calls[record.stage, record.status] += 1
+            self._duration_sum[record.stage] += seconds
+            counts = self._duration_buckets[record.stage]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            for kind in ("prompt", "completion"):
+                tokens = getattr(record, f"{kind}_tokens")
+                if tokens:
+                    self._tokens[record.stage, kind] += tokens
+            if record.rows:
+                self._rows[record.stage] += record.rows
+            if record.bytes:
+                self._bytes[record.stage] += record.bytes
+            if record.cache_hit is not None:
+                self._cache[record.stage, "hit" if record.cache_hit else "miss"] += 1
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        with self._lock:
+            family("chat_db_calls_total", "counter", "Instrumented calls by stage and status.",
+                   [((("stage", stage), ("status", status)), n) for (stage, status), n in sorted(self._calls.items())])
+            histogram = []
+            for stage, counts in sorted(self._duration_buckets.items()):
+                for bound, n in zip(self.buckets, counts):
+                    histogram.append(((("stage", stage), ("le", repr(bound))), n))
+                histogram.append(((("stage", stage), ("le", "+Inf")), counts[-1]))
+            lines.append("# HELP chat_db_stage_duration_seconds Wall time per stage.")
+            lines.append("# TYPE chat_db_stage_duration_seconds histogram")
+            for labels, value in histogram:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"chat_db_stage_duration_seconds_bucket{{{label_text}}} {value}")
+            for stage, total in sorted(self._duration_sum.items()):
+                lines.append(f'chat_db_stage_duration_seconds_sum{{stage="{stage}"}} {total}')
+                lines.append(f'chat_db_stage_duration_seconds_count{{stage="{stage}"}} {self._duration_buckets[stage][-1]}')
+            family("chat_db_llm_tokens_total", "counter", "LLM tokens reported by the API.",
+                   [((("stage", stage), ("kind", kind)), n) for (stage, kind), n in sorted(self._tokens.items())])
+            family("chat_db_rows_total", "counter", "Rows returned.",
+                   [((("stage", stage),), n) for stage, n in sorted(self._rows.items())])
+            family("chat_db_bytes_total", "counter", "In-memory bytes of returned results.",
+                   [((("stage", stage),), n) for stage, n in sorted(self._bytes.items())])
+            family("chat_db_cache_lookups_total", "counter", "Cache lookups by stage and outcome.",
+                   [((("stage", stage), ("result", result)), n) for (stage, result), n in sorted(self._cache.items())])
+        return "\n".join(lines) + "\n"
+
+
+class ChatCallInfoWriter:
+    """Hook that writes CallRecords to chat_call_info in batches from a background thread.
+
+    Records are queued on the calling thread and inserted ``batch_size`` at a
+    time, or every ``interval`` seconds, in a single statement. ``connection``
+    is a db_pool.ConnectionFactory; it should not itself be instrumented. When the queue
+    is full (the database is down or slow) new records are dropped and
+    counted in ``dropped``.
+    """
+
+    def __init__(self, connection: ConnectionFactory, batch_size=100, interval=5.0, stages=None, max_queue=10000):
+        self._connection = connection
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stages = set(stages) if stages is not None else None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self.dropped = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="chat-call-info-writer", daemon=True)
+        self._thread.start()
+
+    def __call__(self, record: CallRecord):
+        if self.stages is not None and record.stage not in self.stages:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.interval
+            while self._queue.qsize() < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._stop.wait(min(remaining, 0.1))
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            rows = [
+                (r.conversation_id, r.prompt_tokens, r.completion_tokens, r.total_tokens, r.model_version,
+                 r.query_type, r.duration_ms, r.status, r.error_message, r.stage, r.rows, r.bytes, r.cache_hit,
+                 r.started_at)
+                for r in batch
+            ]
+            try:
+                with self._connection() as conn:
+                    with conn.cursor() as cursor:
+                        pgextras.execute_values(
+                            cursor,
+                            "INSERT INTO chat_call_info (conversation_id, prompt_tokens, completion_tokens, "
+                            "total_tokens, model_version, query_type, execution_time, status, error_message, "
+                            "stage, rows_returned, bytes_returned, cache_hit, created_at) VALUES %s",
+                            rows,
+                            template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, to_timestamp(%s))",
+                            page_size=self.batch_size,
+                        )
+                    conn.commit()
+                self.written += len(rows)
+            except Exception as e:
+                self.dropped += len(rows)
+                logger.warning("Could not write %d chat_call_info rows: %s", len(rows), e)
+                return
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+    """Serve ``registry`` at http://host:port/metrics from a daemon thread; returns the ThreadingHTTPServer."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="chat-db-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,110 @@
+"""Deferred imports and memoized resources, to keep ``import chat_ui`` cheap.
+
+Measure the effect with ``python docs/bench_startup.py``.
+"""
+import functools
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Stands in for a module until one of its attributes is first used."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_import(name: str):
+    """Return ``name`` if it is already imported, otherwise a proxy that imports it on first use.
+
+    Works for submodules (``lazy_import("pyarrow.parquet")``). Annotations
+    that mention a lazy module are evaluated at definition time, so modules
+    using this need ``from __future__ import annotations``.
+    """
+    module = sys.modules.get(name)
+    return module if module is not None else _LazyModule(name)
+
+
+def optional_import(name: str):
+    """Like lazy_import, but None when the package is not installed (checked without importing it)."""
+    try:
+        found = importlib.util.find_spec(name.partition(".")[0]) is not None
+    except ValueError:
+        found = name in sys.modules
+    return lazy_import(name) if found else None
+
+
+def in_streamlit() -> bool:
+    """True when running inside ``streamlit run`` (rather than imported by a script or worker)."""
+    if "streamlit" not in sys.modules:
+        return False
+    try:
+        from streamlit import runtime
+        return runtime.exists()
+    except Exception:
+        return False
+
+
+def cached_resource(func=None, *, max_entries=None):
+    """Memoize a resource factory (client, pool, cache...) for the life of the process.
+
+    Under ``streamlit run`` the first call goes through ``st.cache_resource``,
+    which keeps the object across script reruns and sessions; elsewhere it is
+    an ``lru_cache``. ``.clear()`` drops the cached value(s) either way.
+    """
+    if func is None:
+        return functools.partial(cached_resource, max_entries=max_entries)
+
+    local = functools.lru_cache(maxsize=max_entries)(func)
+    state = {}
+    lock = threading.Lock()
+
+    def resolve():
+        if "impl" not in state:
+            with lock:
+                if "impl" not in state:
+                    if in_streamlit():
+                        import streamlit as st
+                        state["impl"] = st.cache_resource(max_entries=max_entries)(func)
+                    else:
+                        state["impl"] = local
+        return state["impl"]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return resolve()(*args, **kwargs)
+
+    def clear():
+        impl = state.get("impl")
+        if impl is not None and impl is not local:
+            impl.clear()  # st.cache_resource
+        local.cache_clear()
+
+    wrapper.clear = clear
+    wrapper.cache_clear = clear
+    return wrapper
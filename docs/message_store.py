@@ -0,0 +1,141 @@
+import argparse
+import json
+
+from lazy_imports import lazy_import
+
+psycopg2 = lazy_import("psycopg2")
+pgextras = lazy_import("psycopg2.extras")
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Messages are stored one row per turn in conversation_messages (see
+# db/setup.sql), keyed by (conversation_id, seq). Saving a chat only writes the
+# turns added since the last save; conversations.conversation is left NULL for
+# chats stored this way and only holds transcripts written before the switch.
+
+
+def create_conversation(conn, title: str) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO conversations (title) VALUES (%s) RETURNING id", (title,))
+        return cursor.fetchone()[0]
+
+
+def next_seq(conn, conversation_id: int) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(MAX(seq) + 1, 0) FROM conversation_messages WHERE conversation_id = %s",
+            (conversation_id,),
+        )
+        return cursor.fetchone()[0]
+
+
+def append_messages(conn, conversation_id: int, messages, start_seq: int, page_size: int = 500) -> int:
+    """Insert ``messages`` as seq ``start_seq``, ``start_seq + 1``, ... in batched round trips.
+
+    Rows that already exist (e.g. a concurrent save of the same turns) are
+    skipped. Returns the number of messages passed in.
+    """
+    rows = [
+        (conversation_id, start_seq + offset, message.get("role"), json.dumps(message))
+        for offset, message in enumerate(messages)
+    ]
+    if rows:
+        with conn.cursor() as cursor:
+            pgextras.execute_values(
+                cursor,
+                "INSERT INTO conversation_messages (conversation_id, seq, role, message) VALUES %s "
+                "ON CONFLICT (conversation_id, seq) DO NOTHING",
+                rows,
+                page_size=page_size,
+            )
+    return len(rows)
+
+
+def save_new_messages(conn, conversation_id: int, conversation) -> int:
+    """Append the turns of ``conversation`` that are not stored yet; returns how many were written."""
+    start = next_seq(conn, conversation_id)
+    return append_messages(conn, conversation_id, conversation[start:], start)
+
+
+def load_transcripts(conn, conversation_ids) -> dict:
+    """Rebuild transcripts for several conversations in one query: ``{id: [message, ...]}``."""
+    transcripts = {conversation_id: [] for conversation_id in conversation_ids}
+    if not transcripts:
+        return transcripts
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT conversation_id, message FROM conversation_messages "
+            "WHERE conversation_id = ANY(%s) ORDER BY conversation_id, seq",
+            (list(transcripts),),
+        )
+        for conversation_id, message in cursor:
+            transcripts[conversation_id].append(json_loads(message))
+    return transcripts
+
+
+def load_transcript(conn, conversation_id: int, legacy=None):
+    """Transcript of one conversation, falling back to the legacy JSON column when it has no message rows."""
+    messages = load_transcripts(conn, [conversation_id])[conversation_id]
+    if messages or legacy is None:
+        return messages
+    return json_loads(legacy) if isinstance(legacy, (str, bytes)) else legacy
+
+
+def migrate_legacy_conversations(conn, batch_size: int = 100, clear_legacy: bool = False) -> int:
+    """Copy transcripts from conversations.conversation into conversation_messages.
+
+    Conversations that already have message rows are skipped, so the migration
+    can be re-run safely. With ``clear_legacy`` the TEXT column is set to NULL
+    once its messages are copied. Commits after every batch; returns the number
+    of conversations migrated.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.id, c.conversation FROM conversations c "
+                "WHERE c.id > %s AND c.conversation IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM conversation_messages m WHERE m.conversation_id = c.id) "
+                "ORDER BY c.id LIMIT %s",
+                (last_id, batch_size),
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return migrated
+        for conversation_id, legacy in rows:
+            last_id = conversation_id
+            try:
+                messages = json_loads(legacy)
+            except ValueError:
+                continue  # leave unreadable transcripts in place
+            if not isinstance(messages, list):
+                continue
+            append_messages(conn, conversation_id, messages, 0)
+            if clear_legacy:
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE conversations SET conversation = NULL WHERE id = %s", (conversation_id,))
+            migrated += 1
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy legacy conversation transcripts into conversation_messages.")
+    parser.add_argument("dsn", help="PostgreSQL connection string")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--clear-legacy", action="store_true", help="NULL out conversations.conversation after copying")
+    args = parser.parse_args()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        migrated = migrate_legacy_conversations(conn, args.batch_size, args.clear_legacy)
+    finally:
+        conn.close()
+    print(f"Migrated {migrated} conversations.")
+
+
+if __name__ == "__main__":
+    main()
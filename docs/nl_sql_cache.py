@@ -0,0 +1,255 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- Key construction ---
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    normalized = re.sub(r"\s+", " ", question.strip().lower())
+    return normalized.rstrip(" ?.!;")
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def cache_key(question: str, context: str) -> str:
+    """``context`` identifies everything besides the question that shapes the
+    completion (schema, model, examples), e.g. PromptBuilder.fingerprint."""
+    return _digest(context, normalize_question(question))
+
+
+# --- Storage backends ---
+# Entries are plain dicts: {"sql", "question", "asked", "context", "created_at"}.
+class MemoryBackend:
+    """In-process LRU cache with optional TTL."""
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry["created_at"] > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def entries(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteBackend:
+    """On-disk cache that survives restarts; LRU order is kept via last_used."""
+
+    def __init__(self, path, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS nl_sql_cache (
+                key TEXT PRIMARY KEY,
+                entry TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS nl_sql_cache_last_used ON nl_sql_cache (last_used)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT entry, created_at FROM nl_sql_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM nl_sql_cache WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE nl_sql_cache SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def set(self, key, entry):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO nl_sql_cache (key, entry, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry), entry["created_at"], now),
+            )
+            self._db.execute(
+                """DELETE FROM nl_sql_cache WHERE key IN (
+                    SELECT key FROM nl_sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def entries(self):
+        with self._lock:
+            rows = self._db.execute("SELECT key, entry FROM nl_sql_cache ORDER BY last_used").fetchall()
+        return [(key, json.loads(entry)) for key, entry in rows]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM nl_sql_cache")
+
+
+# --- Near-duplicate matching ---
+_QUOTED_RE = re.compile(r"(?<!\w)'[^']*'(?!\w)|\"[^\"]*\"")
+
+
+def literals(question: str) -> tuple:
+    """Values a question's SQL is likely to embed: quoted strings, numbers and capitalized names.
+
+    Sentence-initial words and "I" are not counted as names. Needs the
+    question as asked, before normalize_question lower-cases it.
+    """
+    found = [quoted.lower() for quoted in _QUOTED_RE.findall(question)]
+    sentence_start = True
+    for word in re.findall(r"[\w']+|[.?!:;]", _QUOTED_RE.sub(" ", question)):
+        if word in ".?!:;":
+            sentence_start = True
+            continue
+        word = re.sub(r"'s$", "", word).strip("'")
+        if word and (any(c.isdigit() for c in word) or (word[0].isupper() and not sentence_start and word != "I")):
+            found.append(word.lower())
+        sentence_start = False
+    return tuple(sorted(found))
+
+
+def shingles(text: str, size: int = 2) -> frozenset:
+    """Word n-gram shingles of a normalized question (plus unigrams for short text)."""
+    tokens = re.findall(r"[a-z0-9_.']+", normalize_question(text))
+    grams = {tuple(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 0))}
+    grams.update((token,) for token in tokens)
+    return frozenset(grams)
+
+
+class ShingleMatcher:
+    """Jaccard similarity over token shingles, scoped per prompt context.
+
+    Two questions that differ only by a company name or a year still share
+    most of their shingles, yet need different SQL; only questions with the
+    same ``literals`` are compared. Names that are neither capitalized nor
+    resolved to entity ids (which are part of chat_ui's cache context) are not
+    caught, so the threshold should stay high.
+    """
+
+    def __init__(self, threshold=0.9, size=2):
+        self.threshold = threshold
+        self.size = size
+        self._index = {}  # context -> {key: (shingles, literals)}
+        self._lock = threading.Lock()
+
+    def add(self, context, question, key):
+        with self._lock:
+            self._index.setdefault(context, {})[key] = (shingles(question, self.size), literals(question))
+
+    def discard(self, context, key):
+        with self._lock:
+            self._index.get(context, {}).pop(key, None)
+
+    def best_match(self, context, question):
+        query, query_literals = shingles(question, self.size), literals(question)
+        if not query:
+            return None
+        best_key, best_score = None, 0.0
+        with self._lock:
+            for key, (candidate, candidate_literals) in self._index.get(context, {}).items():
+                if candidate_literals != query_literals:
+                    continue
+                union = len(query | candidate)
+                score = len(query & candidate) / union if union else 0.0
+                if score > best_score:
+                    best_key, best_score = key, score
+        return best_key if best_score >= self.threshold else None
+
+
+# --- Cache front-end ---
+class NLSQLCache:
+    """Cache of validated SQL produced for a natural-language question."""
+
+    def __init__(self, backend=None, matcher=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.matcher = matcher
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        if matcher is not None:
+            for key, entry in self.backend.entries():
+                if "asked" in entry:  # older entries only kept the lower-cased question, without its names
+                    matcher.add(entry["context"], entry["asked"], key)
+
+    def get(self, question, context):
+        entry = self.backend.get(cache_key(question, context))
+        if entry is not None:
+            self._count("hits")
+            return entry["sql"]
+        if self.matcher is not None:
+            key = self.matcher.best_match(context, question)
+            if key is not None:
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count("near_hits")
+                    return entry["sql"]
+                self.matcher.discard(context, key)  # evicted from the backend
+        self._count("misses")
+        return None
+
+    def put(self, question, context, sql):
+        key = cache_key(question, context)
+        entry = {
+            "sql": sql,
+            "question": normalize_question(question),
+            "asked": question,
+            "context": context,
+            "created_at": time.time(),
+        }
+        self.backend.set(key, entry)
+        if self.matcher is not None:
+            self.matcher.add(context, question, key)
+
+    def clear(self):
+        self.backend.clear()
+        if self.matcher is not None:
+            self.matcher = type(self.matcher)(self.matcher.threshold, self.matcher.size)
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            }
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
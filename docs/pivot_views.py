@@ -0,0 +1,500 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+
+from db_pool import ConnectionFactory
+from lazy_imports import lazy_import
+from sql_guard import set_statement_timeout
+
+psycopg2 = lazy_import("psycopg2")
+pgsql = lazy_import("psycopg2.sql")
+sqlglot = lazy_import("sqlglot")
+exp = lazy_import("sqlglot.expressions")
+
+logger = logging.getLogger("chat_db.pivot_views")
+
+# Indexes the EAV joins in generated SQL depend on
+RECOMMENDED_INDEXES = {
+    "extracted2_filename_key_idx": "CREATE INDEX IF NOT EXISTS extracted2_filename_key_idx ON extracted2 (filename, key)",
+    "extracted2_page_label_id_idx": "CREATE INDEX IF NOT EXISTS extracted2_page_label_id_idx ON extracted2 (page_label, id)",
+    "pages_preprocessed_idx": "CREATE INDEX IF NOT EXISTS pages_preprocessed_idx ON pages (preprocessed)",
+    "entities_entity_name_idx": "CREATE INDEX IF NOT EXISTS entities_entity_name_idx ON entities (entity_name)",
+}
+
+# extracted2 columns the wide tables lack; an unqualified reference to one may resolve to extracted2 from any scope
+_EXTRACTED2_ONLY_COLUMNS = {"id", "key", "value", "page_label", "page_confidence", "page_num", "created_at"}
+
+# Tables the accelerator owns; they are an implementation detail, not part of the prompt schema
+PIVOT_TABLES = ("pivot_*", "pivot_view_state")
+
+_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS pivot_view_state (
+    page_label TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    keys TEXT NOT NULL,          -- JSON object: extracted2.key -> column name
+    last_extracted_id BIGINT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+)
+"""
+
+
+def missing_indexes(conn) -> list:
+    """CREATE INDEX statements from RECOMMENDED_INDEXES that do not exist yet."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)", (list(RECOMMENDED_INDEXES),))
+        existing = {row[0] for row in cursor.fetchall()}
+    return [ddl for name, ddl in RECOMMENDED_INDEXES.items() if name not in existing]
+
+
+def create_missing_indexes(conn) -> list:
+    """Create the missing RECOMMENDED_INDEXES without blocking writes; returns the statements run.
+
+    CREATE INDEX CONCURRENTLY cannot run in a transaction block, so ``conn``
+    is switched to autocommit for the duration (and must be idle).
+    """
+    statements = [ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1) for ddl in missing_indexes(conn)]
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for ddl in statements:
+                cursor.execute(ddl)
+    finally:
+        conn.autocommit = autocommit
+    return statements
+
+
+def _identifier(text: str, prefix: str = "") -> str:
+    name = re.sub(r"[^a-z0-9_]+", "_", text.lower()).strip("_") or "col"
+    return (prefix + name)[:63]
+
+
+# --- Recognizing pivot queries ---
+def _pivot_case_key(case: exp.Case, alias: str):
+    """Key of ``MAX(CASE WHEN <alias>.key = 'k' THEN <alias>.value END)``, or None for any other CASE.
+
+    The wide table holds exactly that MAX per filename, so the CASE must be
+    the whole argument of a plain (not windowed) MAX.
+    """
+    parent = case.parent
+    if not isinstance(parent, exp.Max) or case.arg_key != "this" or isinstance(parent.parent, exp.Window):
+        return None
+    ifs = case.args.get("ifs") or []
+    if case.args.get("default") is not None or case.this is not None or len(ifs) != 1:
+        return None
+    condition, result = ifs[0].this, ifs[0].args.get("true")
+    if not isinstance(condition, exp.EQ) or not isinstance(result, exp.Column):
+        return None
+    if result.table != alias or result.name != "value":
+        return None
+    column, literal = condition.this, condition.expression
+    if isinstance(column, exp.Literal):
+        column, literal = literal, column
+    if not (isinstance(column, exp.Column) and column.table == alias and column.name == "key"):
+        return None
+    if not (isinstance(literal, exp.Literal) and literal.is_string):
+        return None
+    return literal.this
+
+
+def _conjuncts(where: exp.Where):
+    condition = where.this
+    return list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+
+
+class PivotMatch:
+    """A query whose only use of extracted2 is pivoting keys of one page_label per filename."""
+
+    def __init__(self, tree, select, table, label_predicate, cases):
+        self.tree = tree
+        self.select = select
+        self.table = table
+        self.label_predicate = label_predicate
+        self.cases = cases  # [(Case node, key)]
+
+    @property
+    def page_label(self):
+        return self.label_predicate.expression.this
+
+    @property
+    def keys(self):
+        return {key for _, key in self.cases}
+
+
+def match_pivot(sql: str):
+    """Return a PivotMatch when ``sql`` can be served from a wide per-page_label table, else None."""
+    try:
+        tree = sqlglot.parse_one(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return None
+    tables = [t for t in tree.find_all(exp.Table) if t.name == "extracted2"]
+    if len(tables) != 1 or not isinstance(tree, exp.Select):
+        return None
+    table = tables[0]
+    alias = table.alias_or_name
+    select = table.find_ancestor(exp.Select)
+    if select is not tree or select.args.get("where") is None:
+        return None
+
+    label_predicates = []
+    for conjunct in _conjuncts(select.args["where"]):
+        if (
+            isinstance(conjunct, exp.EQ)
+            and isinstance(conjunct.this, exp.Column)
+            and conjunct.this.table == alias
+            and conjunct.this.name == "page_label"
+            and isinstance(conjunct.expression, exp.Literal)
+            and conjunct.expression.is_string
+        ):
+            label_predicates.append(conjunct)
+    if len(label_predicates) != 1:
+        return None
+
+    cases = []
+    for case in select.find_all(exp.Case):
+        key = _pivot_case_key(case, alias)
+        if key is not None:
+            cases.append((case, key))
+    if not cases:
+        return None
+
+    # Other aggregates (COUNT(*), SUM(...), MIN(CASE ...)) see one row per extracted2 row, the rewrite one per filename.
+    pivots = {id(case.parent) for case, _ in cases}
+    for aggregate in select.find_all(exp.AggFunc):
+        if id(aggregate) not in pivots and aggregate.find_ancestor(exp.Select) is select:
+            return None
+
+    # Every other reference to extracted2 must be its filename.
+    allowed = {id(node) for case, _ in cases for node in case.walk()}
+    allowed.update(id(node) for node in label_predicates[0].walk())
+    for column in tree.find_all(exp.Column):
+        if id(column) in allowed or column.name == "filename":
+            continue
+        if column.table == alias or (not column.table and column.name in _EXTRACTED2_ONLY_COLUMNS):
+            return None
+    return PivotMatch(tree, select, table, label_predicates[0], cases)
+
+
+def _is_extracted2(node) -> bool:
+    if isinstance(node, exp.Schema):  # INSERT INTO t (columns)
+        node = node.this
+    return isinstance(node, exp.Table) and node.name == "extracted2"
+
+
+def invalidates_pivots(sql: str) -> bool:
+    """True when ``sql`` may change or remove existing extracted2 rows.
+
+    Plain INSERTs are picked up by the id watermark and statements that only
+    read extracted2 change nothing; anything else needs a full rebuild.
+    """
+    try:
+        statements = sqlglot.parse(sql, read="postgres")
+    except sqlglot.errors.ParseError:
+        return "extracted2" in sql.lower()
+    for statement in statements:
+        if statement is None:
+            continue
+        for node in statement.walk():
+            # Class names (rather than classes) keep this working across sqlglot versions.
+            kind = type(node).__name__
+            if kind == "TruncateTable":
+                targets = node.expressions
+            elif kind == "Drop":
+                targets = node.args.get("tables") or [node.this]
+            elif kind in ("Update", "Delete", "Merge", "Alter", "AlterTable"):
+                targets = [node.this]
+            elif kind == "Insert" and node.args.get("conflict") is not None:  # ON CONFLICT DO UPDATE
+                targets = [node.this]
+            else:
+                continue
+            if any(_is_extracted2(target) for target in targets):
+                return True
+    return False
+
+
+# --- Accelerator ---
+class PivotAccelerator:
+    """Materializes hot extracted2 pivots as wide tables and rewrites queries onto them.
+
+    ``observe`` counts (page_label, keys) combinations in executed queries; a
+    page_label seen ``min_hits`` times gets a table ``pivot_<label>`` with one
+    row per filename and one TEXT column per observed key. Tables are built
+    and refreshed incrementally from extracted2.id on a background thread
+    (``schedule``); rewritten queries read filenames that gained rows since
+    the last refresh straight from extracted2, so results are never staler
+    than the base table.
+
+    ``connection`` is a db_pool.ConnectionFactory (e.g. ``get_connection``);
+    maintenance statements run under ``statement_timeout_ms``.
+    """
+
+    def __init__(
+        self,
+        connection: ConnectionFactory,
+        min_hits: int = 3,
+        max_keys: int = 200,
+        create_indexes: bool = False,
+        statement_timeout_ms: int = None,
+    ):
+        self._connection = connection
+        self.min_hits = min_hits
+        self.max_keys = max_keys
+        self.create_indexes = create_indexes
+        self.statement_timeout_ms = statement_timeout_ms
+        self._hits = Counter()
+        self._observed_keys = defaultdict(Counter)
+        self._views = None  # page_label -> {"table", "keys": {key: column}, "watermark"}
+        self._dirty = set()
+        self._dirty_all = False
+        self._marks = Counter()  # mark_dirty calls per page_label, so a build can tell if it raced one
+        # Guards the in-memory state above; no database I/O happens while it is held
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    # --- State ---
+    def _load_state(self):
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                set_statement_timeout(cursor, self.statement_timeout_ms)
+                cursor.execute(_STATE_DDL)
+                cursor.execute("SELECT page_label, table_name, keys, last_extracted_id FROM pivot_view_state")
+                rows = cursor.fetchall()
+            conn.commit()
+            if self.create_indexes:
+                create_missing_indexes(conn)
+        with self._lock:
+            self._views = {
+                label: {"table": table, "keys": json.loads(keys), "watermark": watermark}
+                for label, table, keys, watermark in rows
+            }
+            if self._dirty_all:
+                self._dirty.update(self._views)
+                self._dirty_all = False
+
+    def observe(self, sql: str) -> bool:
+        """Count a pivot query; returns True when its page_label is hot enough to maintain a table for."""
+        match = match_pivot(sql)
+        if match is None:
+            return False
+        label = match.page_label
+        with self._lock:
+            self._hits[label] += 1
+            self._observed_keys[label].update(match.keys)
+            return self._hits[label] >= self.min_hits
+
+    def hot_combinations(self) -> dict:
+        """{page_label: Counter of keys} for labels queried at least ``min_hits`` times."""
+        with self._lock:
+            return {
+                label: Counter(self._observed_keys[label])
+                for label, hits in self._hits.items()
+                if hits >= self.min_hits
+            }
+
+    def mark_dirty(self, page_label=None):
+        """Force a full rebuild (e.g. after UPDATE/DELETE on extracted2, which watermarks cannot see)."""
+        with self._lock:
+            if page_label:
+                labels = {page_label}
+            elif self._views is None:
+                self._dirty_all = True
+                labels = set()
+            else:
+                labels = set(self._views)
+            self._dirty.update(labels)
+            self._marks.update(labels)
+
+    # --- Maintenance ---
+    def schedule(self):
+        """Run ``maintain`` on the background maintainer thread, starting it on first use."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-db-pivot-maintainer", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.warning("Pivot table maintenance failed: %s", e)
+
+    def maintain(self):
+        """Create or widen tables for hot combinations and refresh the rest."""
+        if self._views is None:
+            self._load_state()
+        for label, keys in self.hot_combinations().items():
+            wanted = {key for key, _ in keys.most_common(self.max_keys)}
+            with self._lock:
+                view = self._views.get(label)
+                build = view is None or not wanted <= set(view["keys"]) or label in self._dirty
+                marks = self._marks[label]
+            if build:
+                self._build(label, keys, marks)
+            else:
+                self._refresh(label, view)
+
+    def _build(self, label, key_counts, marks):
+        # Keep the most requested keys when a label has more than max_keys of them
+        keys = sorted(key for key, _ in key_counts.most_common(self.max_keys))
+        columns, used = {}, {"filename", "refreshed_at"}
+        for key in keys:
+            column = base = _identifier(key)
+            suffix = 1
+            while column in used:
+                suffix += 1
+                column = f"{base[:60]}_{suffix}"
+            used.add(column)
+            columns[key] = column
+        table = _identifier(label, "pivot_")
+        # Fill a staging table and swap it in, so readers of the old table only wait for the swap
+        staging = table[:57] + "_build"
+        column_defs = pgsql.SQL(", ").join(
+            pgsql.SQL("{} TEXT").format(pgsql.Identifier(column)) for column in columns.values()
+        )
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                set_statement_timeout(cursor, self.statement_timeout_ms)
+                cursor.execute(pgsql.SQL("DROP TABLE IF EXISTS {}").format(pgsql.Identifier(staging)))
+                cursor.execute(
+                    pgsql.SQL(
+                        "CREATE TABLE {} (filename TEXT PRIMARY KEY, {}, refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT now())"
+                    ).format(pgsql.Identifier(staging), column_defs)
+                )
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM extracted2 WHERE page_label = %s", (label,))
+                watermark = cursor.fetchone()[0]
+                self._upsert(cursor, staging, label, columns, filenames=None)
+                cursor.execute(pgsql.SQL("DROP TABLE IF EXISTS {}").format(pgsql.Identifier(table)))
+                cursor.execute(
+                    pgsql.SQL("ALTER TABLE {} RENAME TO {}").format(pgsql.Identifier(staging), pgsql.Identifier(table))
+                )
+                cursor.execute(
+                    "INSERT INTO pivot_view_state (page_label, table_name, keys, last_extracted_id, refreshed_at) "
+                    "VALUES (%s, %s, %s, %s, now()) ON CONFLICT (page_label) DO UPDATE SET "
+                    "table_name = EXCLUDED.table_name, keys = EXCLUDED.keys, "
+                    "last_extracted_id = EXCLUDED.last_extracted_id, refreshed_at = now()",
+                    (label, table, json.dumps(columns), watermark),
+                )
+            conn.commit()
+        with self._lock:
+            self._views[label] = {"table": table, "keys": columns, "watermark": watermark}
+            # A mark_dirty() that arrived mid-build may not be reflected in the rows just read
+            if self._marks[label] == marks:
+                self._dirty.discard(label)
+
+    def _refresh(self, label, view):
+        """Recompute rows for filenames that gained extracted2 rows since the last refresh."""
+        with self._connection() as conn:
+            with conn.cursor() as cursor:
+                set_statement_timeout(cursor, self.statement_timeout_ms)
+                cursor.execute(
+                    "SELECT COALESCE(MAX(id), %s), array_agg(DISTINCT filename) FROM extracted2 "
+                    "WHERE page_label = %s AND id > %s",
+                    (view["watermark"], label, view["watermark"]),
+                )
+                watermark, filenames = cursor.fetchone()
+                if not filenames:
+                    conn.rollback()
+                    return
+                self._upsert(cursor, view["table"], label, view["keys"], filenames)
+                cursor.execute(
+                    "UPDATE pivot_view_state SET last_extracted_id = GREATEST(last_extracted_id, %s), "
+                    "refreshed_at = now() WHERE page_label = %s",
+                    (watermark, label),
+                )
+            conn.commit()
+        with self._lock:
+            if self._views.get(label) is view:
+                view["watermark"] = watermark
+
+    @staticmethod
+    def _upsert(cursor, table, label, columns, filenames):
+        names = [pgsql.Identifier(column) for column in columns.values()]
+        pivots = pgsql.SQL(", ").join(
+            pgsql.SQL("MAX(CASE WHEN e.key = {} THEN e.value END)").format(pgsql.Literal(key)) for key in columns
+        )
+        filter_sql = pgsql.SQL(" AND e.filename = ANY(%(filenames)s)") if filenames is not None else pgsql.SQL("")
+        statement = pgsql.SQL(
+            "INSERT INTO {table} (filename, {names}) "
+            "SELECT e.filename, {pivots} FROM extracted2 e WHERE e.page_label = %(label)s{filter} GROUP BY e.filename "
+            "ON CONFLICT (filename) DO UPDATE SET {updates}, refreshed_at = now()"
+        ).format(
+            table=pgsql.Identifier(table),
+            names=pgsql.SQL(", ").join(names),
+            pivots=pivots,
+            filter=filter_sql,
+            updates=pgsql.SQL(", ").join(pgsql.SQL("{0} = EXCLUDED.{0}").format(name) for name in names),
+        )
+        cursor.execute(statement, {"label": label, "filenames": filenames})
+
+    # --- Rewriting ---
+    @staticmethod
+    def _current_rows(view, label, keys):
+        """The wide table, with filenames that gained extracted2 rows since its watermark recomputed from extracted2."""
+        label_sql = exp.Literal.string(label).sql(dialect="postgres")
+        newer = (
+            f"SELECT 1 FROM extracted2 n WHERE n.page_label = {label_sql} "
+            f"AND n.id > {int(view['watermark'])} AND n.filename = {{}}.filename"
+        )
+        columns = ", ".join(exp.to_identifier(view["keys"][key], quoted=True).sql(dialect="postgres") for key in keys)
+        pivots = ", ".join(
+            f"MAX(CASE WHEN e.key = {exp.Literal.string(key).sql(dialect='postgres')} THEN e.value END) AS "
+            + exp.to_identifier(view["keys"][key], quoted=True).sql(dialect="postgres")
+            for key in keys
+        )
+        table = exp.to_identifier(view["table"], quoted=True).sql(dialect="postgres")
+        return sqlglot.parse_one(
+            f"SELECT p.filename, {columns} FROM {table} p WHERE NOT EXISTS ({newer.format('p')}) "
+            f"UNION ALL SELECT e.filename, {pivots} FROM extracted2 e "
+            f"WHERE e.page_label = {label_sql} AND EXISTS ({newer.format('e')}) GROUP BY e.filename",
+            read="postgres",
+        )
+
+    def rewrite(self, sql: str) -> str:
+        """Point a pivot query at its wide table when one covers all of its keys; otherwise return ``sql``."""
+        match = match_pivot(sql)
+        if match is None:
+            return sql
+        with self._lock:
+            view = (self._views or {}).get(match.page_label)
+            if view is None or match.page_label in self._dirty or not match.keys <= set(view["keys"]):
+                return sql
+            view = dict(view)
+        alias = match.table.alias_or_name
+        for case, key in match.cases:
+            case.replace(exp.column(view["keys"][key], table=alias, quoted=True))
+        remaining = [c for c in _conjuncts(match.select.args["where"]) if c is not match.label_predicate]
+        match.select.set("where", exp.Where(this=exp.and_(*remaining)) if remaining else None)
+        rows = self._current_rows(view, match.page_label, sorted(match.keys))
+        match.table.replace(rows.subquery(alias))
+        return match.tree.sql(dialect="postgres")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend (or create) the indexes extracted2 pivot queries rely on.")
+    parser.add_argument("dsn", help="PostgreSQL connection string")
+    parser.add_argument("--create", action="store_true", help="create the missing indexes instead of printing them")
+    args = parser.parse_args()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        statements = create_missing_indexes(conn) if args.create else missing_indexes(conn)
+        for ddl in statements:
+            print(ddl + ";")
+    finally:
+        conn.close()
+    if not statements:
+        print("All recommended indexes exist.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import io
+import pickle
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from lazy_imports import lazy_import, optional_import
+
+pd = lazy_import("pandas")
+pa = optional_import("pyarrow")  # optional: None when not installed
+
+
+# --- SQL inspection ---
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")+")
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_WRITE_KEYWORDS = {"insert", "update", "delete", "merge", "truncate", "create", "drop", "alter", "grant", "revoke"}
+_VOLATILE_FUNCTIONS = {"now", "random", "current_timestamp", "current_date", "current_time",
+                       "localtimestamp", "clock_timestamp", "statement_timestamp", "nextval", "gen_random_uuid"}
+_TABLE_LIST_END = {"where", "group", "order", "having", "limit", "offset", "union", "intersect", "except",
+                   "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "window",
+                   "returning", "set", "values", "select", "for", "fetch", "lateral"}
+
+
+def _tokens(sql: str):
+    """Yield (kind, text) tokens, dropping comments and whitespace."""
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        yield kind, match.group()
+
+
+def normalize_sql(sql: str) -> str:
+    """Canonical text for cache keys: no comments, single spaces, lower-cased outside literals."""
+    parts = []
+    for kind, text in _tokens(sql):
+        parts.append(text if kind in ("string", "quoted") else text.lower())
+    normalized = " ".join(parts)
+    return normalized.rstrip("; ")
+
+
+def _identifier(kind, text):
+    if kind == "quoted":
+        return text[1:-1].replace('""', '"')
+    return text.lower()
+
+
+def _read_name(tokens, i):
+    """Read a possibly schema-qualified name starting at tokens[i]; return (name, next_index)."""
+    kind, text = tokens[i]
+    if kind not in ("word", "quoted"):
+        return None, i
+    name = _identifier(kind, text)
+    i += 1
+    while i + 1 < len(tokens) and tokens[i][1] == "." and tokens[i + 1][0] in ("word", "quoted"):
+        name = _identifier(*tokens[i + 1])  # keep the unqualified table name
+        i += 2
+    return name, i
+
+
+def referenced_tables(sql: str) -> set:
+    """Best-effort set of table names a statement reads from or writes to."""
+    tokens = list(_tokens(sql))
+    lowered = [text.lower() if kind == "word" else text for kind, text in tokens]
+    tables = set()
+    i = 0
+    while i < len(tokens):
+        word = lowered[i]
+        if word in ("from", "join", "into", "update", "table", "truncate") and i + 1 < len(tokens):
+            j = i + 1
+            while j < len(tokens) and lowered[j] in ("only", "if", "not", "exists", "table"):
+                j += 1
+            # FROM a, b AS x, c  -> collect every comma-separated item
+            while j < len(tokens):
+                if tokens[j][1] == "(":
+                    break  # sub-select; its own FROM is picked up as we continue scanning
+                name, j = _read_name(tokens, j)
+                if name is None:
+                    break
+                tables.add(name)
+                # Skip an optional alias.
+                if j < len(tokens) and lowered[j] == "as":
+                    j += 1
+                if j < len(tokens) and tokens[j][0] == "word" and lowered[j] not in _TABLE_LIST_END:
+                    j += 1
+                if word == "from" and j < len(tokens) and tokens[j][1] == ",":
+                    j += 1
+                    continue
+                break
+            i = j
+            continue
+        i += 1
+    return tables
+
+
+def is_write(sql: str) -> bool:
+    return any(kind == "word" and text.lower() in _WRITE_KEYWORDS for kind, text in _tokens(sql))
+
+
+def is_cacheable(sql: str) -> bool:
+    """Only deterministic reads can be served from cache."""
+    words = [text.lower() for kind, text in _tokens(sql) if kind == "word"]
+    if not words or words[0] not in ("select", "with"):
+        return False
+    return not any(word in _WRITE_KEYWORDS or word in _VOLATILE_FUNCTIONS for word in words)
+
+
+# --- Frame serialization ---
+def encode_frame(df: pd.DataFrame) -> bytes:
+    """Serialize a DataFrame to compressed Arrow IPC (or zlib'd pickle without pyarrow)."""
+    if pa is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return b"A" + sink.getvalue().to_pybytes()
+    return b"P" + zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode_frame(payload: bytes) -> pd.DataFrame:
+    tag, body = payload[:1], payload[1:]
+    if tag == b"A":
+        return pa.ipc.open_stream(io.BytesIO(body)).read_all().to_pandas()
+    return pickle.loads(zlib.decompress(body))
+
+
+# --- Cache ---
+class ResultCache:
+    """Size-bounded cache of query results with per-table generation counters.
+
+    Each entry remembers the generation of every table it read. A write that
+    touches a table bumps its generation, which makes all dependent entries
+    stale without having to find them. Take a ``snapshot`` before running a
+    query and pass it to ``put``: a result whose tables were written to while
+    it ran is not stored, since it may predate the write.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # guards against writes made by other clients
+        self._entries = OrderedDict()  # key -> (payload, generations, created_at)
+        self._generations = {}
+        self._global_generation = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql: str):
+        payload = self.get_encoded(sql)
+        return decode_frame(payload) if payload is not None else None
+
+    def put(self, sql: str, df: pd.DataFrame, snapshot: dict = None):
+        self.put_encoded(sql, encode_frame(df), snapshot)
+
+    def snapshot(self, sql: str) -> dict:
+        """Current generations of the tables ``sql`` reads, for a later ``put``."""
+        tables = referenced_tables(sql)
+        with self._lock:
+            return self._generations_of(tables)
+
+    # get/put on encode_frame() payloads, so a cache shared between processes
+    # only moves bytes and each client does its own (de)serialization.
+    def get_encoded(self, sql: str):
+        key = normalize_sql(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put_encoded(self, sql: str, payload: bytes, snapshot: dict = None):
+        if len(payload) > self.max_bytes:
+            return
+        key = normalize_sql(sql)
+        tables = referenced_tables(sql)
+        with self._lock:
+            generations = self._generations_of(tables)
+            if snapshot is not None and snapshot != generations:
+                return  # written to since the query started
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (payload, generations, time.time())
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_for_write(self, sql: str):
+        """Bump generations for every table a write statement may have changed."""
+        tables = referenced_tables(sql)
+        with self._lock:
+            if not tables:
+                # Could not tell what changed (e.g. DROP SCHEMA); invalidate everything.
+                self._global_generation += 1
+                return
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+    # --- Internal helpers (callers hold self._lock) ---
+    def _generations_of(self, tables):
+        generations = {table: self._generations.get(table, 0) for table in tables}
+        generations[None] = self._global_generation
+        return generations
+
+    def _is_fresh(self, entry):
+        _, generations, created_at = entry
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            return False
+        for table, generation in generations.items():
+            current = self._global_generation if table is None else self._generations.get(table, 0)
+            if current != generation:
+                return False
+        return True
+
+    def _drop(self, key):
+        payload, _, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
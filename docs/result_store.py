@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import datetime
+import decimal
+import os
+import threading
+import uuid
+
+from lazy_imports import lazy_import, optional_import
+from result_cache import decode_frame, encode_frame
+
+pd = lazy_import("pandas")
+pa = optional_import("pyarrow")  # optional: None when not installed
+pq = optional_import("pyarrow.parquet")
+
+_EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet", "pickle": ".pkl.z"}
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def preview_rows(df: pd.DataFrame, n: int) -> list:
+    """First ``n`` rows as JSON-safe lists, small enough to keep in a transcript."""
+    return [[_jsonable(value) for value in row] for row in df.head(n).itertuples(index=False, name=None)]
+
+
+class ResultStore:
+    """Query results kept on disk as compressed Arrow IPC (or Parquet) files, referenced by id.
+
+    ``put`` returns a small JSON-serializable reference (id, shape and a few
+    preview rows) that chat transcripts store instead of the rendered result.
+    Pages are read back one record batch (or row group) at a time, so showing
+    page 3 of a large result never decodes the whole file. Without pyarrow,
+    results are stored as compressed pickles and paged in memory.
+
+    The oldest files are deleted once the store exceeds ``max_bytes``;
+    references to them keep working through their preview.
+    """
+
+    def __init__(self, path, fmt="arrow", compression="zstd", batch_rows=1000, max_bytes=None, preview=5):
+        if pa is None:
+            fmt = "pickle"
+        if fmt not in _EXTENSIONS:
+            raise ValueError(f"Unknown result format {fmt!r}; expected one of {sorted(_EXTENSIONS)}.")
+        self.path = path
+        self.fmt = fmt
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self.max_bytes = max_bytes
+        self.preview = preview
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, result_id, fmt):
+        if not result_id or not all(c in "0123456789abcdef" for c in result_id):
+            raise ValueError(f"Invalid result id {result_id!r}.")
+        return os.path.join(self.path, result_id + _EXTENSIONS[fmt])
+
+    # --- Writing ---
+    def put(self, result) -> dict:
+        """Store a DataFrame or Arrow table; returns its reference."""
+        result_id = uuid.uuid4().hex
+        path = self._file(result_id, self.fmt)
+        tmp = path + ".tmp"
+        if self.fmt == "pickle":
+            df = result.to_pandas() if pa is not None and isinstance(result, pa.Table) else result
+            with open(tmp, "wb") as f:
+                f.write(encode_frame(df))
+            rows, columns, preview = len(df), [str(c) for c in df.columns], preview_rows(df, self.preview)
+        else:
+            table = result if isinstance(result, pa.Table) else pa.Table.from_pandas(result, preserve_index=False)
+            if self.fmt == "arrow":
+                options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                    writer.write_table(table, max_chunksize=self.batch_rows)
+            else:
+                pq.write_table(table, tmp, compression=self.compression, row_group_size=self.batch_rows)
+            rows, columns = table.num_rows, table.column_names
+            preview = preview_rows(table.slice(0, self.preview).to_pandas(), self.preview)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        if self.max_bytes is not None:
+            self.prune(self.max_bytes)
+        return {
+            "result_id": result_id,
+            "format": self.fmt,
+            "rows": rows,
+            "columns": columns,
+            "bytes": size,
+            "preview": preview,
+        }
+
+    # --- Reading ---
+    def exists(self, ref: dict) -> bool:
+        return os.path.exists(self._file(ref["result_id"], ref["format"]))
+
+    def load(self, ref: dict):
+        """The whole result: an Arrow table (a DataFrame for pickled results)."""
+        path = self._file(ref["result_id"], ref["format"])
+        if ref["format"] == "arrow":
+            with pa.memory_map(path) as source:
+                return pa.ipc.open_file(source).read_all()
+        if ref["format"] == "parquet":
+            return pq.read_table(path, memory_map=True)
+        with open(path, "rb") as f:
+            return decode_frame(f.read())
+
+    def page(self, ref: dict, page: int, page_size: int = 100):
+        """Rows ``[page * page_size, (page + 1) * page_size)``, reading only the batches that hold them."""
+        start, stop = page * page_size, (page + 1) * page_size
+        path = self._file(ref["result_id"], ref["format"])
+        if ref["format"] == "pickle":
+            with open(path, "rb") as f:
+                return decode_frame(f.read()).iloc[start:stop].reset_index(drop=True)
+        if ref["format"] == "arrow":
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                chunks, offset = self._overlapping(
+                    (reader.get_batch(i) for i in range(reader.num_record_batches)), lambda batch: batch.num_rows, start, stop
+                )
+                table = pa.Table.from_batches(chunks, schema=reader.schema)
+        else:
+            parquet = pq.ParquetFile(path, memory_map=True)
+            groups, offset = self._overlapping(
+                range(parquet.num_row_groups), lambda i: parquet.metadata.row_group(i).num_rows, start, stop
+            )
+            table = parquet.read_row_groups(groups) if groups else parquet.schema_arrow.empty_table()
+        return table.slice(start - offset, page_size)
+
+    @staticmethod
+    def _overlapping(chunks, length, start, stop):
+        """Chunks overlapping rows [start, stop) and the row offset of the first one."""
+        selected, position, first = [], 0, None
+        for chunk in chunks:
+            size = length(chunk)
+            if position + size > start and position < stop:
+                if first is None:
+                    first = position
+                selected.append(chunk)
+            position += size
+            if position >= stop:
+                break
+        return selected, first if first is not None else start
+
+    # --- Housekeeping ---
+    def delete(self, ref: dict):
+        try:
+            os.remove(self._file(ref["result_id"], ref["format"]))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_bytes: int) -> int:
+        """Delete the oldest results until the store fits in ``max_bytes``; returns files removed."""
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for _, size, path in sorted(files):
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            return removed
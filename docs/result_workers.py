@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import shared_cache
+from bulk_writes import affected_rows
+from lazy_imports import lazy_import
+from result_cache import decode_frame, is_cacheable
+from result_store import ResultStore
+from sql_guard import analyze, check_cost, explain, set_statement_timeout
+
+pd = lazy_import("pandas")
+psycopg2 = lazy_import("psycopg2")
+
+# Per-process state, set up by _init_worker
+_state = {}
+
+
+def _init_worker(connect_kwargs, store_options, limits, cache_address, cache_authkey):
+    _state["connect_kwargs"] = connect_kwargs
+    _state["store"] = ResultStore(**store_options)
+    _state["limits"] = limits
+    _state["conn"] = None
+    _state["cache"] = shared_cache.connect(cache_address, cache_authkey)[0] if cache_address else None
+
+
+def _connection():
+    conn = _state["conn"]
+    if conn is None or conn.closed:
+        conn = _state["conn"] = psycopg2.connect(**_state["connect_kwargs"])
+    return conn
+
+
+def _execute(query: str) -> pd.DataFrame:
+    """Guarded execution, as in chat_ui.run_sql_query."""
+    auto_limit, timeout_ms, max_cost = _state["limits"]
+    analysis = analyze(query, auto_limit=auto_limit)
+    conn = _connection()
+    try:
+        with conn.cursor() as cursor:
+            set_statement_timeout(cursor, timeout_ms)
+            explain(cursor, analysis)
+        check_cost(analysis, max_cost)
+        if analysis.is_read:
+            df = pd.read_sql_query(analysis.sql, conn)
+            conn.rollback()
+        else:
+            with conn.cursor() as cursor:
+                cursor.execute(analysis.sql)
+                df = pd.DataFrame({
+                    "statement_type": [analysis.statement_type],
+                    "rows_affected": [affected_rows(cursor)],
+                })
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    return df
+
+
+def run_and_store(query: str, cache_result: bool = True) -> dict:
+    """Worker entry point: run ``query`` and put its result in the results store.
+
+    Returns ``{"ref": <ResultStore reference>, "cache_hit": bool}`` or
+    ``{"error": message}``; only the small reference travels back to the caller.
+    ``cache_result=False`` still reads the shared cache but does not fill it.
+    """
+    cache = _state["cache"] if is_cacheable(query) else None
+    try:
+        snapshot = cache.snapshot(query) if cache is not None else None
+        payload = cache.get_encoded(query) if cache is not None else None
+        if payload is not None:
+            df = decode_frame(payload)
+        else:
+            df = _execute(query)
+            if cache is not None and cache_result:
+                cache.put(query, df, snapshot)
+        return {"ref": _state["store"].put(df), "cache_hit": payload is not None}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def cache_stored(query: str, ref: dict, snapshot: dict) -> bool:
+    """Worker entry point: put a stored result in the shared cache, as run_and_store would have.
+
+    For queries run with ``cache_result=False`` whose result the caller later
+    decides to keep; ``snapshot`` is the cache snapshot taken before they ran.
+    """
+    cache = _state["cache"]
+    if cache is None or not is_cacheable(query):
+        return False
+    result = _state["store"].load(ref)
+    cache.put(query, result if isinstance(result, pd.DataFrame) else result.to_pandas(), snapshot)
+    return True
+
+
+class ResultWorkers:
+    """Worker processes that run queries and serialize their results outside the UI process.
+
+    Building DataFrames and writing Arrow files is CPU-bound and holds the GIL;
+    here it happens in ``processes`` spawned workers, each with its own
+    database connection. Results land in the ResultStore described by
+    ``store_options`` (shared with the caller through the filesystem). With
+    ``cache_address`` the workers read and fill a shared_cache server.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        connect_kwargs: dict,
+        store_options: dict,
+        auto_limit: int = None,
+        statement_timeout_ms: int = None,
+        max_cost: float = None,
+        cache_address=None,
+        cache_authkey: bytes = None,
+    ):
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),  # the parent has threads; do not fork it
+            initializer=_init_worker,
+            initargs=(connect_kwargs, store_options, (auto_limit, statement_timeout_ms, max_cost),
+                      cache_address, cache_authkey),
+        )
+
+    def submit(self, query: str, cache_result: bool = True):
+        return self._executor.submit(run_and_store, query, cache_result)
+
+    def cache_stored(self, query: str, ref: dict, snapshot: dict):
+        return self._executor.submit(cache_stored, query, ref, snapshot)
+
+    def run(self, query: str) -> dict:
+        return self.submit(query).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
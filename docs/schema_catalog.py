@@ -0,0 +1,286 @@
+import re
+import threading
+import time
+from collections import deque
+from fnmatch import fnmatchcase
+
+from db_pool import ConnectionFactory
+from lazy_imports import lazy_import
+
+pgextras = lazy_import("psycopg2.extras")
+
+_COLUMNS_SQL = """
+SELECT c.table_name,
+       c.column_name,
+       c.data_type,
+       c.is_nullable,
+       col_description(format('%%I.%%I', c.table_schema, c.table_name)::regclass, c.ordinal_position) AS column_comment,
+       obj_description(format('%%I.%%I', c.table_schema, c.table_name)::regclass, 'pg_class') AS table_comment
+FROM information_schema.columns c
+JOIN information_schema.tables t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE c.table_schema = ANY(%(schemas)s)
+  AND t.table_type IN ('BASE TABLE', 'VIEW')
+  {table_filter}
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+_CONSTRAINTS_SQL = """
+SELECT con.contype,
+       rel.relname AS table_name,
+       att.attname AS column_name,
+       frel.relname AS ref_table,
+       fatt.attname AS ref_column
+FROM pg_constraint con
+JOIN pg_class rel ON rel.oid = con.conrelid
+JOIN pg_namespace nsp ON nsp.oid = rel.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, n)
+JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+LEFT JOIN pg_class frel ON frel.oid = con.confrelid
+LEFT JOIN LATERAL unnest(con.confkey) WITH ORDINALITY AS fk(attnum, n) ON fk.n = k.n
+LEFT JOIN pg_attribute fatt ON fatt.attrelid = con.confrelid AND fatt.attnum = fk.attnum
+WHERE con.contype IN ('p', 'f')
+  AND nsp.nspname = ANY(%(schemas)s)
+  {table_filter}
+"""
+
+_SHORT_TYPES = {
+    "timestamp with time zone": "timestamptz",
+    "timestamp without time zone": "timestamp",
+    "character varying": "varchar",
+    "double precision": "double",
+}
+
+_FK_COMMENT_RE = re.compile(r"foreign key to (?:\w+ \()?(?:e\.g\.,\s*)?(\w+)\.(\w+)", re.IGNORECASE)
+
+
+def parse_schema_annotations(schema_text: str) -> dict:
+    """Pull table/column comments out of a hand-written schema string (prompt_resources.SCHEMA).
+
+    Returns ``{table: {"comment": str, "columns": {column: comment}}}``; used
+    to describe columns that have no COMMENT in the database.
+    """
+    annotations = {}
+    current = None
+    pending = None  # lines of a table comment spanning several lines
+    for line in schema_text.splitlines():
+        if pending is not None:
+            pending.append(line.split("*/", 1)[0].strip())
+            if "*/" in line:
+                current["comment"] = " ".join(part for part in pending if part)
+                pending = None
+            continue
+        header = re.match(r"\s*Table:\s*(\w+)\s*\(", line)
+        if header:
+            current = annotations.setdefault(header.group(1), {"comment": "", "columns": {}})
+            continue
+        if current is None:
+            continue
+        column = re.match(r"\s*(\w+)\s+[A-Za-z].*?/\*\s*(.*?)\s*\*/", line)
+        if column:
+            current["columns"][column.group(1)] = column.group(2)
+        elif not current["comment"] and line.strip().startswith("/*"):
+            body = line.split("/*", 1)[1]
+            if "*/" in body:
+                current["comment"] = body.split("*/", 1)[0].strip()
+            else:
+                pending = [body.strip()]
+    return annotations
+
+
+class SchemaCatalog:
+    """Live view of the database schema, introspected once and cached with a TTL.
+
+    ``connection`` is a db_pool.ConnectionFactory (e.g. ``get_connection``).
+    DDL seen by run_sql_query should be reported through ``mark_stale`` so
+    only the affected tables are re-read on next use. ``exclude_tables`` are
+    names or glob patterns (``pivot_*``) of tables to leave out of the prompt.
+    """
+
+    def __init__(
+        self,
+        connection: ConnectionFactory,
+        schemas=("public",),
+        ttl=600.0,
+        annotations=None,
+        core_tables=(),
+        exclude_tables=(),
+    ):
+        self._connection = connection
+        self.schemas = list(schemas)
+        self.ttl = ttl
+        self.annotations = annotations or {}
+        self.core_tables = tuple(core_tables)
+        self.exclude_tables = set(exclude_tables)
+        self._tables = {}  # name -> {"comment", "columns": [...], "primary_key": set()}
+        self._foreign_keys = {}  # name -> [(column, ref_table, ref_column)]
+        self._loaded_at = None
+        self._stale = set()
+        self._stale_all = False
+        self._lock = threading.Lock()
+        self._render_cache = {}
+
+    def _excluded(self, name) -> bool:
+        return any(fnmatchcase(name, pattern) for pattern in self.exclude_tables)
+
+    # --- Introspection ---
+    def _introspect(self, tables=None):
+        params = {"schemas": self.schemas, "tables": list(tables or ())}
+        columns_sql = _COLUMNS_SQL.format(
+            table_filter="AND c.table_name = ANY(%(tables)s)" if tables is not None else ""
+        )
+        constraints_sql = _CONSTRAINTS_SQL.format(
+            table_filter="AND rel.relname = ANY(%(tables)s)" if tables is not None else ""
+        )
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=pgextras.DictCursor) as cursor:
+                cursor.execute(columns_sql, params)
+                column_rows = cursor.fetchall()
+                cursor.execute(constraints_sql, params)
+                constraint_rows = cursor.fetchall()
+            conn.rollback()
+
+        found = {}
+        for row in column_rows:
+            table = found.setdefault(
+                row["table_name"],
+                {"comment": row["table_comment"] or "", "columns": [], "primary_key": set()},
+            )
+            table["columns"].append({
+                "name": row["column_name"],
+                "type": _SHORT_TYPES.get(row["data_type"], row["data_type"]),
+                "nullable": row["is_nullable"] == "YES",
+                "comment": row["column_comment"] or "",
+            })
+        foreign_keys = {name: [] for name in found}
+        for row in constraint_rows:
+            if row["table_name"] not in found:
+                continue
+            if row["contype"] == "p":
+                found[row["table_name"]]["primary_key"].add(row["column_name"])
+            else:
+                foreign_keys[row["table_name"]].append((row["column_name"], row["ref_table"], row["ref_column"]))
+        return found, foreign_keys
+
+    def _ensure_fresh(self):
+        with self._lock:
+            expired = self._loaded_at is None or (
+                self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+            )
+            if expired or self._stale_all:
+                self._tables, self._foreign_keys = self._introspect()
+                self._loaded_at = time.monotonic()
+                self._stale.clear()
+                self._stale_all = False
+                self._render_cache.clear()
+            elif self._stale:
+                tables, foreign_keys = self._introspect(self._stale)
+                for name in self._stale:
+                    self._tables.pop(name, None)  # dropped tables simply do not come back
+                    self._foreign_keys.pop(name, None)
+                self._tables.update(tables)
+                self._foreign_keys.update(foreign_keys)
+                self._stale.clear()
+                self._render_cache.clear()
+
+    def mark_stale(self, tables=None):
+        """Schedule a refresh of ``tables`` (or of everything when no table is known)."""
+        with self._lock:
+            if tables:
+                self._stale.update(tables)
+            else:
+                self._stale_all = True
+
+    def tables(self) -> dict:
+        self._ensure_fresh()
+        return self._tables
+
+    # --- Rendering ---
+    def _describe(self, table_name, table):
+        notes = self.annotations.get(table_name, {})
+        lines = [f"Table: {table_name}("]
+        comment = table["comment"] or notes.get("comment", "")
+        if comment:
+            lines.append(f"    /* {comment} */")
+        foreign_keys = {column: (ref_table, ref_column) for column, ref_table, ref_column in self._foreign_keys.get(table_name, [])}
+        columns = []
+        for column in table["columns"]:
+            text = f"    {column['name']} {column['type']}"
+            if column["name"] in table["primary_key"]:
+                text += " PRIMARY KEY"
+            if column["name"] in foreign_keys:
+                text += " REFERENCES {}({})".format(*foreign_keys[column["name"]])
+            column_comment = column["comment"] or notes.get("columns", {}).get(column["name"], "")
+            columns.append((text, column_comment))
+        for i, (text, column_comment) in enumerate(columns):
+            separator = "," if i < len(columns) - 1 else ""
+            lines.append(f"{text}{separator}" + (f"  /* {column_comment} */" if column_comment else ""))
+        lines.append(")")
+        return "\n".join(lines)
+
+    def render(self, tables=None) -> str:
+        """Compact schema text for the prompt, optionally limited to ``tables``."""
+        self._ensure_fresh()
+        names = sorted(name for name in self._tables if not self._excluded(name))
+        if tables is not None:
+            names = [name for name in names if name in tables]
+        key = tuple(names)
+        rendered = self._render_cache.get(key)
+        if rendered is None:
+            rendered = self._render_cache[key] = "\n".join(self._describe(name, self._tables[name]) for name in names)
+        return rendered
+
+    # --- Pruning ---
+    def _join_graph(self):
+        graph = {name: set() for name in self._tables}
+        for table, keys in self._foreign_keys.items():
+            for _, ref_table, _ in keys:
+                if ref_table in graph:
+                    graph[table].add(ref_table)
+                    graph[ref_table].add(table)
+        # Relationships only documented in comments (e.g. extracted2.filename -> pages.preprocessed)
+        for table, notes in self.annotations.items():
+            for comment in notes.get("columns", {}).values():
+                match = _FK_COMMENT_RE.search(comment)
+                if match and table in graph and match.group(1) in graph:
+                    graph[table].add(match.group(1))
+                    graph[match.group(1)].add(table)
+        return graph
+
+    def relevant_tables(self, question: str) -> set:
+        """Tables a question is likely to need, plus the tables joining them together."""
+        self._ensure_fresh()
+        words = set()
+        for word in re.findall(r"[a-z0-9]+", question.lower()):
+            words.add(word)
+            words.add(word.rstrip("s"))
+        selected = {name for name in self.core_tables if name in self._tables}
+        for name, table in self._tables.items():
+            if self._excluded(name):
+                continue
+            name_parts = set(name.lower().split("_")) | {name.lower(), name.lower().rstrip("s")}
+            if words & name_parts:
+                selected.add(name)
+        if not selected:
+            return {name for name in self._tables if not self._excluded(name)}
+        # Connect every selected table to the first one via shortest join paths.
+        graph = self._join_graph()
+        ordered = sorted(selected)
+        root = ordered[0]
+        parents = {root: None}
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for neighbour in graph.get(node, ()):
+                if neighbour not in parents:
+                    parents[neighbour] = node
+                    queue.append(neighbour)
+        for name in ordered[1:]:
+            node = name
+            while node is not None and node in parents:
+                selected.add(node)
+                node = parents[node]
+        return selected
+
+    def render_for(self, question: str) -> str:
+        return self.render(self.relevant_tables(question))
@@ -0,0 +1,115 @@
+"""Serve the NL->SQL and result caches to several processes over a local socket.
+
+Start one server per node, then point every chat_ui process (and result
+worker) at it with SHARED_CACHE_ADDRESS / SHARED_CACHE_AUTHKEY:
+
+    SHARED_CACHE_AUTHKEY=secret python docs/shared_cache.py --address 127.0.0.1:50000
+"""
+import argparse
+import os
+from multiprocessing.managers import BaseManager
+
+from nl_sql_cache import MemoryBackend
+from result_cache import ResultCache, decode_frame, encode_frame
+
+# Cache instances living in the server process
+_caches = {}
+
+
+def _init_caches(result_max_bytes, result_ttl, sql_max_entries, sql_ttl):
+    _caches["result"] = ResultCache(max_bytes=result_max_bytes, ttl=result_ttl)
+    _caches["sql"] = MemoryBackend(max_entries=sql_max_entries, ttl=sql_ttl)
+
+
+def _result_cache():
+    return _caches["result"]
+
+
+def _sql_backend():
+    return _caches["sql"]
+
+
+class CacheManager(BaseManager):
+    pass
+
+
+CacheManager.register(
+    "result_cache", callable=_result_cache,
+    exposed=("get_encoded", "put_encoded", "snapshot", "invalidate_for_write", "clear", "stats"),
+)
+CacheManager.register("sql_backend", callable=_sql_backend, exposed=("get", "set", "entries", "clear"))
+
+
+def parse_address(address: str):
+    """``host:port`` (TCP) or a filesystem path (Unix socket)."""
+    host, sep, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port)) if sep and port.isdigit() else address
+
+
+def start_server(address, authkey: bytes, result_max_bytes=256 * 1024 * 1024, result_ttl=None,
+                 sql_max_entries=10000, sql_ttl=None) -> CacheManager:
+    """Start the cache server in a child process; stop it with ``manager.shutdown()``."""
+    manager = CacheManager(address=address, authkey=authkey)
+    manager.start(_init_caches, (result_max_bytes, result_ttl, sql_max_entries, sql_ttl))
+    return manager
+
+
+def connect(address, authkey: bytes):
+    """Connect to a running server; returns ``(SharedResultCache, sql cache backend)``."""
+    manager = CacheManager(address=address, authkey=authkey)
+    manager.connect()
+    return SharedResultCache(manager.result_cache()), manager.sql_backend()
+
+
+class SharedResultCache:
+    """ResultCache interface over a server-side cache; frames are (de)serialized in this process."""
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def get(self, sql: str):
+        payload = self._proxy.get_encoded(sql)
+        return decode_frame(payload) if payload is not None else None
+
+    def put(self, sql: str, df, snapshot: dict = None):
+        self._proxy.put_encoded(sql, encode_frame(df), snapshot)
+
+    def snapshot(self, sql: str) -> dict:
+        return self._proxy.snapshot(sql)
+
+    def get_encoded(self, sql: str):
+        return self._proxy.get_encoded(sql)
+
+    def put_encoded(self, sql: str, payload: bytes, snapshot: dict = None):
+        self._proxy.put_encoded(sql, payload, snapshot)
+
+    def invalidate_for_write(self, sql: str):
+        self._proxy.invalidate_for_write(sql)
+
+    def clear(self):
+        self._proxy.clear()
+
+    def stats(self):
+        return self._proxy.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=os.environ.get("SHARED_CACHE_ADDRESS", "127.0.0.1:50000"),
+                        help="host:port or Unix socket path")
+    parser.add_argument("--result-max-bytes", type=int, default=256 * 1024 * 1024)
+    parser.add_argument("--result-ttl", type=float)
+    parser.add_argument("--sql-max-entries", type=int, default=10000)
+    parser.add_argument("--sql-ttl", type=float)
+    args = parser.parse_args()
+    authkey = os.environ.get("SHARED_CACHE_AUTHKEY")
+    if not authkey:
+        parser.error("SHARED_CACHE_AUTHKEY must be set")
+    _init_caches(args.result_max_bytes, args.result_ttl, args.sql_max_entries, args.sql_ttl)
+    manager = CacheManager(address=parse_address(args.address), authkey=authkey.encode())
+    print(f"Serving shared caches on {args.address}")
+    manager.get_server().serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+from dataclasses import dataclass, field
+
+from lazy_imports import lazy_import
+
+sqlglot = lazy_import("sqlglot")
+exp = lazy_import("sqlglot.expressions")
+
+# Statement types the chat assistant may run, by sqlglot expression class name.
+# Class names (rather than classes) keep this working across sqlglot versions.
+READ_TYPES = {"Select", "Union", "Intersect", "Except"}
+WRITE_TYPES = {"Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable", "TruncateTable"}
+
+# Functions with side effects outside the statement itself or that can stall the server
+DENIED_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend", "pg_cancel_backend",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "lo_import", "lo_export",
+    "dblink", "dblink_exec", "set_config", "pg_reload_conf", "pg_rotate_logfile",
+}
+
+
+class SQLRejected(ValueError):
+    """Raised when a statement fails pre-execution checks."""
+
+
+@dataclass
+class Analysis:
+    sql: str  # statement to execute (possibly rewritten with a LIMIT)
+    statement_type: str
+    is_read: bool
+    tables: set = field(default_factory=set)
+    limit_added: bool = False
+    cost: float = None  # planner total cost, once explain() has run
+    plan_rows: float = None
+
+
+def analyze(sql: str, auto_limit: int = None) -> Analysis:
+    """Parse ``sql`` and reject anything but a single allowed statement.
+
+    Unbounded top-level SELECTs get ``LIMIT auto_limit`` appended when
+    ``auto_limit`` is set.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLRejected(f"Could not parse SQL: {e}") from e
+    if len(statements) != 1:
+        raise SQLRejected(f"Expected exactly one SQL statement, got {len(statements)}.")
+    statement = statements[0]
+    statement_type = type(statement).__name__
+    if statement_type not in READ_TYPES | WRITE_TYPES:
+        raise SQLRejected(f"{statement_type} statements are not allowed.")
+
+    for func in statement.find_all(exp.Func):
+        name = (func.name if isinstance(func, exp.Anonymous) else func.sql_name()).lower()
+        if name in DENIED_FUNCTIONS:
+            raise SQLRejected(f"Function {name}() is not allowed.")
+
+    # WITH x AS (DELETE ... RETURNING *) SELECT ... is a write in disguise
+    modifies = any(True for _ in statement.find_all(exp.Insert, exp.Update, exp.Delete))
+    is_read = statement_type in READ_TYPES and not modifies
+
+    cte_names = {cte.alias_or_name for cte in statement.find_all(exp.CTE)}
+    tables = {table.name for table in statement.find_all(exp.Table) if table.name not in cte_names}
+
+    analysis = Analysis(sql=sql.strip().rstrip(";"), statement_type=statement_type, is_read=is_read, tables=tables)
+    if is_read and auto_limit and not statement.args.get("limit"):
+        analysis.sql = statement.limit(auto_limit).sql(dialect="postgres")
+        analysis.limit_added = True
+    return analysis
+
+
+def _explainable(analysis: Analysis) -> bool:
+    return analysis.statement_type in READ_TYPES | {"Insert", "Update", "Delete", "Merge"}  # not DDL
+
+
+def _apply_plan(analysis: Analysis, plan) -> Analysis:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    top = plan[0]["Plan"]
+    analysis.cost = top.get("Total Cost")
+    analysis.plan_rows = top.get("Plan Rows")
+    return analysis
+
+
+def explain(cursor, analysis: Analysis) -> Analysis:
+    """Fill in the planner's cost estimate (EXPLAIN without ANALYZE never runs the statement)."""
+    if not _explainable(analysis):
+        return analysis
+    cursor.execute("EXPLAIN (FORMAT JSON) " + analysis.sql)
+    return _apply_plan(analysis, cursor.fetchone()[0])
+
+
+async def explain_async(conn, analysis: Analysis, timeout: float = None) -> Analysis:
+    """explain() for an asyncpg connection."""
+    if not _explainable(analysis):
+        return analysis
+    return _apply_plan(analysis, await conn.fetchval("EXPLAIN (FORMAT JSON) " + analysis.sql, timeout=timeout))
+
+
+def check_cost(analysis: Analysis, max_cost: float = None):
+    if max_cost is not None and analysis.cost is not None and analysis.cost > max_cost:
+        raise SQLRejected(
+            f"Query is too expensive to run (estimated cost {analysis.cost:,.0f}, limit {max_cost:,.0f}). "
+            "Try narrowing it, e.g. to a single entity or document type."
+        )
+
+
+def set_statement_timeout(cursor, timeout_ms: int):
+    """Bound the rest of the current transaction's statements to ``timeout_ms``."""
+    if timeout_ms:
+        cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+
+
+async def set_statement_timeout_async(conn, timeout_ms: int):
+    """set_statement_timeout() for an asyncpg connection (inside ``conn.transaction()``)."""
+    if timeout_ms:
+        # SET takes no bind parameters; set_config(..., true) is its transaction-local equivalent
+        await conn.execute("SELECT set_config('statement_timeout', $1, true)", str(int(timeout_ms)))
@@ -0,0 +1,380 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+
+from lazy_imports import optional_import
+from prompt_resources import render_examples
+
+# Loading a tiktoken encoding is slow, so it happens on the first count;
+# without tiktoken, counts fall back to a character-based estimate.
+tiktoken = optional_import("tiktoken")
+
+# Statement types convert_to_sql will hand back to the caller; keep in step with sql_guard's READ/WRITE_TYPES
+ALLOWED_PREFIXES = (
+    "select",
+    "with",
+    "insert",
+    "update",
+    "delete",
+    "merge",
+    "create",
+    "drop",
+    "alter",
+    "truncate",
+)
+
+# Static instructions go first so that every request shares the same prefix
+# (schema + fixed examples) and the provider's prompt cache can reuse it.
+SYSTEM_TEMPLATE = """You are an expert data scientist specialized in SQL query generation. Analyze the provided PostgreSQL database schema and think step-by-step to produce precise and optimized SQL queries.
+
+Database Schema:
+{schema}
+
+Generate only valid PostgreSQL SQL queries (SELECT, CREATE, UPDATE, DELETE, DROP, etc.). For queries tagged as [complex query], carefully review the schema and consider joining multiple tables. Use information_schema for metadata queries when necessary.
+{examples_section}
+Your answer must be a single, valid PostgreSQL SQL query with no additional commentary."""
+
+EXAMPLES_SECTION = """
+Examples:
+{examples}
+"""
+
+USER_TEMPLATE = """Write a SQL query to answer the following natural language request:
+\"\"\"{nl_query}\"\"\""""
+
+def _with_context(user: str, context: str = None) -> str:
+    return f"{user}\n\n{context}" if context else user
+
+
+# Chat formatting overhead per message and for priming the reply (OpenAI cookbook figures)
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_REPLY_PRIMING = 3
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when installed, otherwise estimates ~4 chars per token."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.exact = tiktoken is not None
+        self._encoding = None
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("o200k_base")
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if self.exact:
+            return len(self._get_encoding().encode(text))
+        return (len(text) + 3) // 4
+
+
+class PromptAssets:
+    """Token counts of compiled static prefixes, by fingerprint, persisted as JSON.
+
+    Lets a fresh process build prompts without re-counting (and loading the
+    tokenizer for) the schema and examples. Entries are written as prefixes
+    are compiled, or ahead of time with ``python docs/sql_prompt.py PATH``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._tokens = json.load(f)
+        except (OSError, ValueError):
+            self._tokens = {}
+
+    def get(self, fingerprint: str, exact: bool):
+        entry = self._tokens.get(fingerprint)
+        # An estimate is not reused once tiktoken is available
+        return entry["tokens"] if entry and (entry["exact"] or not exact) else None
+
+    def put(self, fingerprint: str, tokens: int, exact: bool):
+        with self._lock:
+            self._tokens[fingerprint] = {"tokens": tokens, "exact": exact}
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._tokens, f)
+                os.replace(tmp, self.path)
+            except OSError:
+                pass  # a read-only location only costs a recount in the next process
+
+
+@dataclass
+class CompiledPrompt:
+    messages: list
+    prompt_tokens: int  # estimate of what the request will be billed for
+    static_tokens: int  # part of prompt_tokens eligible for provider-side caching
+    examples_used: int
+    examples_dropped: int = 0
+    fingerprint: str = field(default="", repr=False)  # identifies the static prefix
+
+
+class PromptBuilder:
+    """Compiles the static part of the NL->SQL prompt once and reuses it per request.
+
+    ``examples`` is a list of ``{"question", "sql"}`` pairs that is sent with
+    every request as part of the static prefix. When ``example_store`` is set
+    (see example_store.ExampleStore), the ``top_k`` most relevant examples are
+    retrieved per question instead and sent after the static prefix.
+
+    When a request would exceed ``token_budget``, trailing (least relevant)
+    examples are dropped until it fits; if even the bare schema does not fit a
+    ``ValueError`` is raised.
+    """
+
+    def __init__(
+        self,
+        schema: str,
+        examples: list,
+        model: str = "gpt-4o",
+        token_budget: int = None,
+        example_store=None,
+        top_k: int = 3,
+        assets: PromptAssets = None,
+    ):
+        self.schema = schema
+        self.examples = list(examples)
+        self.model = model
+        self.token_budget = token_budget
+        self.example_store = example_store
+        self.top_k = top_k
+        self.assets = assets
+        self.counter = TokenCounter(model)
+        self._prefixes = {}  # number of static examples -> (system message, token count, fingerprint)
+
+    def _prefix(self, n_examples: int):
+        compiled = self._prefixes.get(n_examples)
+        if compiled is None:
+            section = EXAMPLES_SECTION.format(examples=render_examples(self.examples[:n_examples])) if n_examples else ""
+            system = SYSTEM_TEMPLATE.format(schema=self.schema, examples_section=section)
+            fingerprint = hashlib.sha256(f"{self.model}\x00{system}".encode("utf-8")).hexdigest()
+            tokens = self.assets.get(fingerprint, self.counter.exact) if self.assets is not None else None
+            if tokens is None:
+                tokens = self.counter.count(system) + _TOKENS_PER_MESSAGE
+                if self.assets is not None:
+                    self.assets.put(fingerprint, tokens, self.counter.exact)
+            compiled = self._prefixes[n_examples] = (system, tokens, fingerprint)
+        return compiled
+
+    def precompile(self):
+        """Compile every static prefix up front (all example counts the token budget may fall back to)."""
+        for n_examples in range(len(self.examples) + 1):
+            self._prefix(n_examples)
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever the schema, the examples (or example store contents) or the model change."""
+        if self.example_store is None:
+            return self._prefix(len(self.examples))[2]
+        base = self._prefix(0)[2]
+        return hashlib.sha256(f"{base}\x00{self.example_store.version}".encode("utf-8")).hexdigest()
+
+    def build(self, nl_query: str, context: str = None) -> CompiledPrompt:
+        """Prompt for ``nl_query``; ``context`` (e.g. resolved entity ids) is appended to the user message."""
+        if self.example_store is not None:
+            return self._build_retrieved(nl_query, context)
+        user = _with_context(USER_TEMPLATE.format(nl_query=nl_query), context)
+        user_tokens = self.counter.count(user) + _TOKENS_PER_MESSAGE + _TOKENS_REPLY_PRIMING
+        n_examples = len(self.examples)
+        while True:
+            system, static_tokens, fingerprint = self._prefix(n_examples)
+            total = static_tokens + user_tokens
+            if self.token_budget is None or total <= self.token_budget:
+                break
+            if n_examples == 0:
+                raise ValueError(
+                    f"Prompt needs {total} tokens, which exceeds the budget of {self.token_budget}."
+                )
+            n_examples -= 1
+        return CompiledPrompt(
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            prompt_tokens=total,
+            static_tokens=static_tokens,
+            examples_used=n_examples,
+            examples_dropped=len(self.examples) - n_examples,
+            fingerprint=fingerprint,
+        )
+
+    def _build_retrieved(self, nl_query: str, context: str = None) -> CompiledPrompt:
+        system, static_tokens, fingerprint = self._prefix(0)
+        selected = self.example_store.select(nl_query, self.top_k)
+        question = _with_context(USER_TEMPLATE.format(nl_query=nl_query), context)
+        n_examples = len(selected)
+        while True:
+            if n_examples:
+                user = EXAMPLES_SECTION.format(examples=render_examples(selected[:n_examples])).lstrip() + "\n" + question
+            else:
+                user = question
+            total = static_tokens + self.counter.count(user) + _TOKENS_PER_MESSAGE + _TOKENS_REPLY_PRIMING
+            if self.token_budget is None or total <= self.token_budget:
+                break
+            if n_examples == 0:
+                raise ValueError(
+                    f"Prompt needs {total} tokens, which exceeds the budget of {self.token_budget}."
+                )
+            n_examples -= 1
+        return CompiledPrompt(
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            prompt_tokens=total,
+            static_tokens=static_tokens,
+            examples_used=n_examples,
+            examples_dropped=len(selected) - n_examples,
+            fingerprint=fingerprint,
+        )
+
+
+def describe_usage(prompt: CompiledPrompt, usage=None) -> str:
+    """One-line token report for a request, including provider-reported usage when available."""
+    report = (
+        f"Prompt tokens: ~{prompt.prompt_tokens} (static ~{prompt.static_tokens}, "
+        f"examples {prompt.examples_used}/{prompt.examples_used + prompt.examples_dropped})"
+    )
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        report += f"; billed {usage.prompt_tokens} prompt / {usage.completion_tokens} completion, {cached} cached"
+    return report
+
+
+def cleanup_sql_query(raw_query: str) -> str:
+    # Remove triple backticks or any code fences
+    cleaned = re.sub(r"```(?:sql)?", "", raw_query)
+    cleaned = re.sub(r"```", "", cleaned)
+    return cleaned.strip()
+
+
+def extract_sql(completion: str) -> str:
+    """Clean a model completion and make sure it starts with an allowed SQL command."""
+    sql_query = cleanup_sql_query(completion.strip())
+    if not sql_query.lower().startswith(ALLOWED_PREFIXES):
+        raise ValueError("Generated query does not start with a valid SQL command. Aborting for safety.")
+    return sql_query
+
+
+class StreamingSQLExtractor:
+    """Incremental counterpart of extract_sql for streamed completions.
+
+    Feed it the content deltas as they arrive: ``sql`` is the fence-stripped
+    text so far (for showing partial SQL), and ``complete`` turns True once
+    the statement is known to be finished, either at a top-level ``;`` or at
+    the closing code fence. ``statement`` is then the text up to that point.
+    The full reply is kept in ``raw`` so the final SQL can still be taken
+    from extract_sql(raw).
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.complete = False
+        self.statement = None
+        self._pending = ""  # raw text not yet emitted; may end in a partial fence
+        self._started = False
+        self._closed = False
+        self._parts = []
+        self._quote = None  # "'" or '"' while inside a literal or quoted identifier
+        self._comment = None  # "--" or "/*" while inside a comment
+
+    @property
+    def sql(self) -> str:
+        return "".join(self._parts).strip()
+
+    def feed(self, text: str) -> str:
+        if not text:
+            return self.sql
+        self.raw += text
+        if self._closed:
+            return self.sql
+        self._pending += text
+        if not self._started:
+            stripped = self._pending.lstrip()
+            if not stripped or ("```".startswith(stripped[:3]) and len(stripped) < 3):
+                return self.sql  # could still be the start of a fence
+            if stripped.startswith("```"):
+                if "\n" not in stripped:
+                    return self.sql  # wait for the rest of the fence line (e.g. ```sql)
+                stripped = stripped.split("\n", 1)[1]
+            self._pending = stripped
+            self._started = True
+        fence = self._pending.find("```")
+        if fence >= 0:
+            self._emit(self._pending[:fence])
+            self._pending = ""
+            self._closed = True
+            self._finish()
+        else:
+            keep = len(self._pending) - len(self._pending.rstrip("`"))
+            self._emit(self._pending[: len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+        return self.sql
+
+    def _finish(self):
+        if not self.complete:
+            self.complete = True
+            self.statement = self.sql
+
+    def _emit(self, text: str):
+        for i, char in enumerate(text):
+            if self.complete:
+                self._parts.append(text[i:])
+                return
+            previous = self._parts[-1][-1:] if self._parts else ""
+            self._parts.append(char)
+            if self._comment == "--":
+                if char == "\n":
+                    self._comment = None
+            elif self._comment == "/*":
+                if previous == "*" and char == "/":
+                    self._comment = None
+            elif self._quote is not None:
+                if char == self._quote:
+                    self._quote = None  # a doubled quote simply re-opens on the next char
+            elif char in ("'", '"'):
+                self._quote = char
+            elif previous == "-" and char == "-":
+                self._comment = "--"
+            elif previous == "/" and char == "*":
+                self._comment = "/*"
+            elif char == ";":
+                self._finish()
+
+
+def main():
+    from prompt_resources import EXAMPLES, SCHEMA
+
+    parser = argparse.ArgumentParser(description="Precompile prompt token counts for the built-in schema and examples.")
+    parser.add_argument("path", help="assets file to write, e.g. the PROMPT_ASSETS_PATH used by chat_ui")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--schema-file", help="schema text to compile instead of the built-in SCHEMA")
+    args = parser.parse_args()
+    schema = SCHEMA
+    if args.schema_file:
+        with open(args.schema_file, encoding="utf-8") as f:
+            schema = f.read()
+    assets = PromptAssets(args.path)
+    builder = PromptBuilder(schema, EXAMPLES, model=args.model, assets=assets)
+    builder.precompile()
+    print(f"Wrote {len(EXAMPLES) + 1} prefixes to {args.path} ({'exact' if builder.counter.exact else 'estimated'} counts)")
+
+
+if __name__ == "__main__":
+    main()
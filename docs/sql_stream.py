@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import uuid
+
+from db_pool import ConnectionFactory
+from lazy_imports import lazy_import
+from sql_guard import analyze, check_cost, explain, set_statement_timeout
+
+pd = lazy_import("pandas")
+
+
+def _estimate_row_bytes(row) -> int:
+    """Rough in-memory size of a fetched row; TEXT blobs dominate, so count them exactly."""
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+class QueryStream:
+    """Iterate over a SELECT in DataFrame chunks using a server-side (named) cursor.
+
+    Only ``fetch_size`` rows are held client-side at a time. When ``max_rows``
+    or ``max_bytes`` is reached the cursor is closed early and ``truncated`` is
+    set, so callers can tell a partial result from a complete one. The
+    stream's transaction runs under ``statement_timeout_ms``, and a query the
+    planner costs above ``max_cost`` raises SQLRejected before it is opened.
+
+    ``connection`` is a db_pool.ConnectionFactory (e.g. ``get_connection``).
+    """
+
+    def __init__(self, connection: ConnectionFactory, query, fetch_size=1000, max_rows=None, max_bytes=None,
+                 statement_timeout_ms=None, max_cost=None):
+        if fetch_size < 1:
+            raise ValueError("fetch_size must be at least 1")
+        self._connection = connection
+        self.query = query
+        self.fetch_size = fetch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_cost = max_cost
+        self.columns = None
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+        self.done = False
+
+    def __iter__(self):
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as setup:
+                    set_statement_timeout(setup, self.statement_timeout_ms)
+                    if self.max_cost is not None:
+                        check_cost(explain(setup, analyze(self.query)), self.max_cost)
+            except Exception:
+                conn.rollback()
+                raise
+            cursor = conn.cursor(name=f"chat_db_stream_{uuid.uuid4().hex}")
+            cursor.itersize = self.fetch_size
+            try:
+                cursor.execute(self.query)
+                while True:
+                    batch_size = self.fetch_size
+                    if self.max_rows is not None:
+                        batch_size = min(batch_size, self.max_rows - self.rows)
+                        if batch_size <= 0:
+                            # Peek one row to tell "exactly max_rows" from "more available".
+                            self.truncated = bool(cursor.fetchmany(1))
+                            break
+                    rows = cursor.fetchmany(batch_size)
+                    if self.columns is None and cursor.description is not None:
+                        self.columns = [column[0] for column in cursor.description]
+                    if not rows:
+                        break
+                    if self.max_bytes is not None:
+                        rows = self._take_within_byte_cap(rows)
+                    else:
+                        self.bytes += sum(_estimate_row_bytes(row) for row in rows)
+                    self.rows += len(rows)
+                    if rows:
+                        yield pd.DataFrame.from_records(rows, columns=self.columns)
+                    if self.truncated:
+                        break
+                self.done = True
+            finally:
+                cursor.close()
+                conn.rollback()  # named cursors live in a transaction; end it either way
+
+    def _take_within_byte_cap(self, rows):
+        for i, row in enumerate(rows):
+            row_bytes = _estimate_row_bytes(row)
+            if self.bytes + row_bytes > self.max_bytes:
+                self.truncated = True
+                return rows[:i]
+            self.bytes += row_bytes
+        return rows
+
+    def to_frame(self) -> pd.DataFrame:
+        """Drain the stream into a single DataFrame (still honouring the caps)."""
+        chunks = list(self)
+        if not chunks:
+            return pd.DataFrame(columns=self.columns or [])
+        return pd.concat(chunks, ignore_index=True)
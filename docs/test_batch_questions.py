@@ -0,0 +1,36 @@
+import pytest
+
+from batch_questions import merged_analysis, merged_statement, run_merged
+from sql_guard import Analysis
+
+
+class _Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def fetchall(self):
+        return self.rows
+
+
+def _analysis(sql):
+    return Analysis(sql=sql, statement_type="Select", is_read=True, tables={"entities"})
+
+
+def test_merged_statement_parses():
+    sqlglot = pytest.importorskip("sqlglot")
+    sql = merged_statement(["SELECT 1 AS a, 2 AS a FROM entities", "SELECT entity_name FROM entities WHERE false"])
+    assert sqlglot.parse_one(sql, read="postgres").sql(dialect="postgres")
+
+
+def test_run_merged_keeps_columns():
+    merged = merged_analysis([_analysis("SELECT 1 AS a, 2 AS a"), _analysis("SELECT entity_name, id FROM entities")])
+    # psycopg2 decodes json columns; text is handled too
+    cursor = _Cursor([(1, '["entity_name", "id"]', None), (0, ["a", "a"], [[1, 2], [3, {"k": "v"}]])])
+    duplicate, empty = run_merged(cursor, merged, 2)
+    assert cursor.query == merged.sql
+    assert list(duplicate.columns) == ["a", "a"]
+    assert duplicate.values.tolist() == [[1, 2], [3, {"k": "v"}]]
+    assert list(empty.columns) == ["entity_name", "id"] and empty.empty
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+import bulk_writes
+from bulk_writes import run_writes
+
+
+class _Cursor:
+    rowcount = 1
+
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params=None):
+        self.log.append(query)
+        if "'fail'" in query:
+            raise RuntimeError("boom")
+
+
+class _Connection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return _Cursor(self.log)
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+WRITES = [
+    "UPDATE entities SET entity_name = 'a' WHERE id = 1",
+    "UPDATE entities SET entity_name = 'fail' WHERE id = 2",
+    "UPDATE entities SET entity_name = 'c' WHERE id = 3",
+]
+
+
+def test_rollback_on_first_error():
+    conn = _Connection()
+    results = run_writes(conn, WRITES)
+    assert [r.status for r in results] == ["rolled_back", "error", "skipped"]
+    assert results[1].error == "boom"
+    assert conn.log[-3:] == [WRITES[1], "ROLLBACK TO SAVEPOINT bulk_write", "ROLLBACK"]
+    assert WRITES[2] not in conn.log
+
+
+def test_continue_undoes_only_the_failing_statement():
+    conn = _Connection()
+    results = run_writes(conn, WRITES, on_error="continue")
+    assert [r.status for r in results] == ["success", "error", "success"]
+    assert [r.rows_affected for r in results] == [1, None, 1]
+    assert conn.log.count("RELEASE SAVEPOINT bulk_write") == 2
+    assert conn.log[-1] == "COMMIT"
+
+
+def test_invalid_write_rolls_back_before_running():
+    conn = _Connection()
+    results = run_writes(conn, [WRITES[0], "SELECT * FROM entities"])
+    assert [r.status for r in results] == ["skipped", "error"]
+    assert conn.log == []
+
+
+def test_batched_inserts_are_retried_one_by_one(monkeypatch):
+    batches = []
+
+    def insert_rows(cursor, table, columns, rows, method="values", page_size=1000):
+        batches.append(rows)
+        if ("fail",) in rows:
+            raise RuntimeError("boom")
+        return len(rows)
+
+    monkeypatch.setattr(bulk_writes, "insert_rows", insert_rows)
+    writes = [f"INSERT INTO entities (entity_name) VALUES ('{name}')" for name in ("a", "fail", "c")]
+    results = run_writes(_Connection(), writes, on_error="continue")
+    assert batches == [[("a",), ("fail",), ("c",)], [("a",)], [("fail",)], [("c",)]]
+    assert [r.status for r in results] == ["success", "error", "success"]
+    assert [r.rows_affected for r in results] == [1, None, 1]
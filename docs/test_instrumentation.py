@@ -0,0 +1,38 @@
+import threading
+
+from instrumentation import CallRecord, Instrumentation
+
+
+def test_emit_waits_for_setup_on_another_thread():
+    records = []
+    started, release = threading.Event(), threading.Event()
+
+    def setup(instrumentation):
+        started.set()
+        release.wait(5)
+        instrumentation.add_hook(records.append)
+
+    instrumentation = Instrumentation(setup=setup)
+    first = threading.Thread(target=instrumentation.emit, args=(CallRecord(stage="first", started_at=0.0),))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=instrumentation.emit, args=(CallRecord(stage="second", started_at=0.0),))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive() and not records  # held until the hooks exist
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert sorted(record.stage for record in records) == ["first", "second"]
+
+
+def test_setup_that_emits_does_not_deadlock():
+    records = []
+
+    def setup(instrumentation):
+        instrumentation.add_hook(records.append)
+        instrumentation.emit(CallRecord(stage="setup", started_at=0.0))
+
+    instrumentation = Instrumentation(setup=setup)
+    instrumentation.emit(CallRecord(stage="first", started_at=0.0))
+    assert [record.stage for record in records] == ["setup", "first"]
@@ -0,0 +1,35 @@
+from nl_sql_cache import NLSQLCache, ShingleMatcher, literals
+
+QUESTION = (
+    "What is the monthly rent, lease start date, lease end date and renewal option for the office lease "
+    "signed by Company XYZ in the document set that we uploaded for the quarterly property review last month please"
+)
+
+
+def _cache():
+    cache = NLSQLCache(matcher=ShingleMatcher(threshold=0.9))
+    cache.put(QUESTION, "ctx", "SELECT rent FROM leases WHERE entity_name = 'Company XYZ'")
+    return cache
+
+
+def test_literals():
+    assert literals("Show Company XYZ's leases from 2023 with code 'A-1'. Which are open?") == (
+        "'a-1'", "2023", "company", "xyz",
+    )
+
+
+def test_near_hit_with_same_literals():
+    cache = _cache()
+    assert cache.get(QUESTION.replace("please", "thanks"), "ctx") is not None
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_no_near_hit_when_literals_differ():
+    cache = _cache()
+    assert cache.get(QUESTION.replace("XYZ", "ABC"), "ctx") is None
+    assert cache.get(QUESTION.replace("last month", "in 2023"), "ctx") is None
+    assert cache.stats()["near_hits"] == 0
+
+
+def test_no_near_hit_across_contexts():
+    assert _cache().get(QUESTION.replace("please", "thanks"), "other") is None
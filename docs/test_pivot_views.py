@@ -0,0 +1,130 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from pivot_views import PivotAccelerator, invalidates_pivots, match_pivot
+
+PIVOT = (
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) AS total, "
+    "MAX(CASE WHEN e.key = 'due_date' THEN e.value END) AS due_date "
+    "FROM extracted2 e WHERE e.page_label = 'invoice' GROUP BY e.filename"
+)
+
+
+def _connect():
+    raise AssertionError("rewrite must not touch the database")
+
+
+def _accelerator(keys):
+    accelerator = PivotAccelerator(_connect)
+    accelerator._views = {"invoice": {"table": "pivot_invoice", "keys": keys, "watermark": 10}}
+    return accelerator
+
+
+def test_match_pivot():
+    match = match_pivot(PIVOT)
+    assert match is not None
+    assert match.page_label == "invoice"
+    assert match.keys == {"total", "due_date"}
+
+
+@pytest.mark.parametrize("sql", [
+    # CASE under an aggregate other than MAX
+    "SELECT e.filename, MIN(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename",
+    "SELECT e.filename, COUNT(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename",
+    "SELECT e.filename, SUM(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename",
+    "SELECT e.filename, STRING_AGG(CASE WHEN e.key = 'total' THEN e.value END, ',') FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename",
+    # Bare CASE, and a windowed MAX
+    "SELECT e.filename, CASE WHEN e.key = 'total' THEN e.value END FROM extracted2 e "
+    "WHERE e.page_label = 'invoice'",
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) OVER () FROM extracted2 e "
+    "WHERE e.page_label = 'invoice'",
+    # Other aggregates over the extracted2 rows
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END), COUNT(*) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename",
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' GROUP BY e.filename HAVING COUNT(*) > 1",
+    # Not restricted to one page_label, or using other extracted2 columns
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e GROUP BY e.filename",
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' AND e.page_num = 1 GROUP BY e.filename",
+    # Unqualified extracted2 columns, in the query itself or resolving outward from a subquery
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' AND page_num = 1 GROUP BY e.filename",
+    "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+    "WHERE e.page_label = 'invoice' AND e.filename IN (SELECT preprocessed FROM pages WHERE page_num = 1) "
+    "GROUP BY e.filename",
+])
+def test_match_pivot_rejects(sql):
+    assert match_pivot(sql) is None
+
+
+def test_match_pivot_allows_aggregates_in_subqueries():
+    sql = (
+        "SELECT e.filename, MAX(CASE WHEN e.key = 'total' THEN e.value END) FROM extracted2 e "
+        "WHERE e.page_label = 'invoice' AND e.filename IN (SELECT preprocessed FROM pages GROUP BY preprocessed "
+        "HAVING COUNT(*) > 1) GROUP BY e.filename"
+    )
+    assert match_pivot(sql) is not None
+
+
+def test_rewrite():
+    accelerator = _accelerator({"total": "total", "due_date": "due_date", "vendor": "vendor"})
+    newer = "SELECT 1 FROM extracted2 AS n WHERE n.page_label = 'invoice' AND n.id > 10 AND n.filename = {}.filename"
+    assert accelerator.rewrite(PIVOT) == (
+        'SELECT e.filename, MAX("e"."total") AS total, MAX("e"."due_date") AS due_date FROM ('
+        'SELECT p.filename, "due_date", "total" FROM "pivot_invoice" AS p '
+        f"WHERE NOT EXISTS({newer.format('p')}) "
+        "UNION ALL SELECT e.filename, MAX(CASE WHEN e.key = 'due_date' THEN e.value END) AS \"due_date\", "
+        "MAX(CASE WHEN e.key = 'total' THEN e.value END) AS \"total\" FROM extracted2 AS e "
+        f"WHERE e.page_label = 'invoice' AND EXISTS({newer.format('e')}) GROUP BY e.filename"
+        ") AS e GROUP BY e.filename"
+    )
+
+
+def test_rewrite_keeps_other_filters():
+    accelerator = _accelerator({"total": "total"})
+    sql = (
+        "SELECT extracted2.filename, MAX(CASE WHEN extracted2.key = 'total' THEN extracted2.value END) "
+        "FROM extracted2 WHERE extracted2.page_label = 'invoice' AND extracted2.filename LIKE 'a%' "
+        "GROUP BY extracted2.filename"
+    )
+    rewritten = accelerator.rewrite(sql)
+    assert rewritten.startswith('SELECT extracted2.filename, MAX("extracted2"."total") FROM (SELECT p.filename, "total" ')
+    assert rewritten.endswith(") AS extracted2 WHERE extracted2.filename LIKE 'a%' GROUP BY extracted2.filename")
+
+
+def test_rewrite_skips_dirty_tables():
+    accelerator = _accelerator({"total": "total", "due_date": "due_date"})
+    accelerator.mark_dirty()
+    assert accelerator.rewrite(PIVOT) == PIVOT
+
+
+@pytest.mark.parametrize("sql", [
+    PIVOT.replace("'due_date'", "'po_number'"),  # key the table lacks
+    PIVOT.replace("'invoice'", "'receipt'"),  # page_label without a table
+    PIVOT.replace("MAX(CASE WHEN e.key = 'total'", "MIN(CASE WHEN e.key = 'total'"),
+])
+def test_rewrite_leaves_uncovered_queries(sql):
+    accelerator = _accelerator({"total": "total", "due_date": "due_date"})
+    assert accelerator.rewrite(sql) == sql
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("INSERT INTO extracted2 (filename, key, value) VALUES ('a', 'total', '1')", False),
+    ("INSERT INTO entities (entity_name) SELECT value FROM extracted2 WHERE key = 'vendor'", False),
+    ("DELETE FROM entities WHERE entity_name IN (SELECT value FROM extracted2)", False),
+    ("UPDATE extracted2 SET value = '2' WHERE id = 1", True),
+    ("DELETE FROM extracted2 WHERE filename = 'a'", True),
+    ("TRUNCATE pages, extracted2", True),
+    ("DROP TABLE IF EXISTS pages, extracted2", True),
+    ("ALTER TABLE extracted2 ADD COLUMN note TEXT", True),
+    ("INSERT INTO extracted2 (id, key) VALUES (1, 'total') ON CONFLICT (id) DO UPDATE SET key = EXCLUDED.key", True),
+    ("WITH d AS (DELETE FROM extracted2 RETURNING *) INSERT INTO archive SELECT * FROM d", True),
+])
+def test_invalidates_pivots(sql, expected):
+    assert invalidates_pivots(sql) is expected
@@ -0,0 +1,52 @@
+from result_cache import ResultCache, is_cacheable, referenced_tables
+
+READ = "SELECT entity_name FROM entities WHERE entity_type = 'company'"
+
+
+def test_referenced_tables():
+    assert referenced_tables("SELECT * FROM entities e JOIN pages p ON p.id = e.page_id") == {"entities", "pages"}
+    assert referenced_tables("UPDATE public.entities SET entity_name = 'x'") == {"entities"}
+
+
+def test_is_cacheable():
+    assert is_cacheable(READ)
+    assert not is_cacheable("SELECT now()")
+    assert not is_cacheable("WITH d AS (DELETE FROM entities RETURNING *) SELECT * FROM d")
+
+
+def test_hit_until_write_to_a_read_table():
+    cache = ResultCache()
+    cache.put_encoded(READ, b"rows", cache.snapshot(READ))
+    assert cache.get_encoded(READ.lower()) == b"rows"
+    cache.invalidate_for_write("UPDATE pages SET preprocessed = 'x'")
+    assert cache.get_encoded(READ) == b"rows"
+    cache.invalidate_for_write("UPDATE entities SET entity_name = 'x'")
+    assert cache.get_encoded(READ) is None
+
+
+def test_unknown_write_invalidates_everything():
+    cache = ResultCache()
+    cache.put_encoded(READ, b"rows", cache.snapshot(READ))
+    cache.invalidate_for_write("DROP SCHEMA staging CASCADE")
+    assert cache.get_encoded(READ) is None
+
+
+def test_put_after_concurrent_write_is_dropped():
+    cache = ResultCache()
+    snapshot = cache.snapshot(READ)
+    assert cache.get_encoded(READ) is None  # the read misses and starts running
+    cache.invalidate_for_write("UPDATE entities SET entity_name = 'x'")  # another session's write commits
+    cache.put_encoded(READ, b"pre-write rows", snapshot)
+    assert cache.get_encoded(READ) is None
+    cache.put_encoded(READ, b"rows", cache.snapshot(READ))
+    assert cache.get_encoded(READ) == b"rows"
+
+
+def test_size_bound_evicts_oldest():
+    cache = ResultCache(max_bytes=10)
+    cache.put_encoded("SELECT 1 FROM a", b"123456")
+    cache.put_encoded("SELECT 1 FROM b", b"123456")
+    assert cache.get_encoded("SELECT 1 FROM a") is None
+    assert cache.get_encoded("SELECT 1 FROM b") == b"123456"
+    cache.put_encoded("SELECT 1 FROM c", b"x" * 11)  # larger than the cache
+    assert cache.get_encoded("SELECT 1 FROM c") is None
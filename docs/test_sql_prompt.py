@@ -0,0 +1,50 @@
+import pytest
+
+from sql_prompt import StreamingSQLExtractor, extract_sql
+
+
+def _feed(*deltas):
+    extractor = StreamingSQLExtractor()
+    for delta in deltas:
+        extractor.feed(delta)
+    return extractor
+
+
+def test_fence_split_across_deltas():
+    extractor = _feed("`", "``s", "ql\nSELECT id", " FROM pages", "\n`", "``\nThis lists the pages.")
+    assert extractor.complete
+    assert extractor.statement == "SELECT id FROM pages"
+    assert extractor.raw == "```sql\nSELECT id FROM pages\n```\nThis lists the pages."
+
+
+def test_partial_sql_hides_partial_fences():
+    extractor = StreamingSQLExtractor()
+    assert extractor.feed("``") == ""
+    assert extractor.feed("`sql\nSELECT 1 FROM pages\n``") == "SELECT 1 FROM pages"
+    assert not extractor.complete
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT id FROM entities WHERE entity_name = 'a;b';",
+    'SELECT "odd;name" FROM entities;',
+    "SELECT id FROM entities WHERE entity_name = 'it''s; fine';",
+    "SELECT id -- first; column\nFROM entities;",
+    "SELECT id /* not; the end */ FROM entities;",
+])
+def test_semicolons_in_strings_and_comments(sql):
+    extractor = _feed(*sql)  # one character per delta
+    assert extractor.complete
+    assert extractor.statement == sql
+
+
+def test_text_after_statement():
+    extractor = _feed("SELECT id FROM pages;", " SELECT id FROM entities;", " That should do it.")
+    assert extractor.statement == "SELECT id FROM pages;"
+    assert extractor.sql.endswith("That should do it.")
+
+
+def test_no_terminator():
+    extractor = _feed("SELECT id ", "FROM pages")
+    assert not extractor.complete and extractor.statement is None
+    assert extractor.sql == "SELECT id FROM pages"
+    assert extract_sql(extractor.raw) == "SELECT id FROM pages"